@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# benchmarks/bench_headers.py
+"""
+Micro-benchmarks for the middlewares' fixed per-request cost.
+
+Tiny pages with realistic header sets isolate the header handling (classification
+and snippets are cached after the first request). Each case reports the
+wrapped-minus-bare overhead per request in microseconds:
+
+    python benchmarks/bench_headers.py --output before.json
+    git checkout my-branch
+    python benchmarks/bench_headers.py --output after.json --compare before.json
+"""
+import argparse
+import asyncio
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from envbanner.middleware import WSGIBannerMiddleware, ASGIBannerMiddleware
+from common import compare, write_report
+
+PAGE = b"<!DOCTYPE html><html><head><title>bench</title></head><body><p>hello</p></body></html>"
+CONTENT_TYPES = {"html": "text/html; charset=utf-8", "json": "application/json"}
+
+
+def response_headers(kind: str, extra: int):
+    headers = [
+        ("Content-Type", CONTENT_TYPES[kind]),
+        ("Content-Length", str(len(PAGE))),
+        ("Cache-Control", "no-cache"),
+        ("ETag", '"5d41402abc4b2a76b9719d911017c592"'),
+        ("Date", "Thu, 01 Jan 2026 00:00:00 GMT"),
+        ("Server", "bench"),
+    ]
+    return headers + [(f"X-Extra-{i}", "value") for i in range(extra)]
+
+
+def request_headers(extra: int):
+    headers = [
+        (b"host", b"app.staging.example.com"),
+        (b"user-agent", b"Mozilla/5.0 (X11; Linux x86_64) bench"),
+        (b"accept", b"text/html,application/xhtml+xml"),
+        (b"accept-encoding", b"gzip, br"),
+        (b"accept-language", b"en-US,en;q=0.9"),
+        (b"cookie", b"session=abc; theme=dark"),
+    ]
+    return headers + [(f"x-extra-{i}".encode(), b"value") for i in range(extra)]
+
+
+def wsgi_case(kind: str, extra: int):
+    headers = response_headers(kind, extra)
+
+    def app(environ, start_response):
+        start_response("200 OK", list(headers))
+        return [PAGE]
+
+    environ = {"REQUEST_METHOD": "GET", "PATH_INFO": "/", "HTTP_HOST": "app.staging.example.com",
+               **{f"HTTP_X_EXTRA_{i}": "value" for i in range(extra)}}
+
+    def start_response(status, headers, exc_info=None):
+        return None
+
+    def run(wrapped):
+        def once():
+            body = wrapped(dict(environ), start_response)
+            for _ in body: pass
+            if hasattr(body, "close"): body.close()
+        return once
+
+    return run(app), run(WSGIBannerMiddleware(app))
+
+
+def asgi_case(kind: str, extra: int, loop):
+    headers = [(k.lower().encode(), v.encode()) for k, v in response_headers(kind, extra)]
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": request_headers(extra)}
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": list(headers)})
+        await send({"type": "http.response.body", "body": PAGE})
+
+    async def send(message):
+        return None
+
+    def run(wrapped):
+        async def batch(n):
+            for _ in range(n):
+                await wrapped(scope, None, send)
+        return lambda n: loop.run_until_complete(batch(n))
+
+    return run(app), run(ASGIBannerMiddleware(app))
+
+
+def per_call_us(fn, number: int, repeat: int, batched: bool) -> float:
+    if batched:
+        samples = timeit.repeat(lambda: fn(number), number=1, repeat=repeat)
+    else:
+        samples = timeit.repeat(fn, number=number, repeat=repeat)
+    return min(samples) / number * 1e6
+
+
+def compare_row(old, r) -> str:
+    change = (r["overhead_us"] / old["overhead_us"] - 1) * 100 if old["overhead_us"] > 0 else 0.0
+    return f"{r['name']:<28} overhead {old['overhead_us']:7.2f} -> {r['overhead_us']:7.2f} us  ({change:+.1f}%)"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--extra-headers", type=int, nargs="+", default=[0, 24],
+                        help="additional headers on top of a typical set")
+    parser.add_argument("--number", type=int, default=20000, help="requests per timing sample")
+    parser.add_argument("--repeat", type=int, default=5, help="timing samples; the fastest is kept")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ.pop("APP_ENV", None)
+    os.environ.pop("ENVBANNER_ENV", None)
+    loop = asyncio.new_event_loop()
+    results = []
+    try:
+        for stack in ("wsgi", "asgi"):
+            for kind in ("html", "json"):
+                for extra in args.extra_headers:
+                    if stack == "wsgi":
+                        bare, wrapped = wsgi_case(kind, extra)
+                    else:
+                        bare, wrapped = asgi_case(kind, extra, loop)
+                    batched = stack == "asgi"
+                    bare_us = per_call_us(bare, args.number, args.repeat, batched)
+                    wrapped_us = per_call_us(wrapped, args.number, args.repeat, batched)
+                    r = {"name": f"{stack}/{kind}/{6 + extra}headers", "bare_us": bare_us,
+                         "wrapped_us": wrapped_us, "overhead_us": wrapped_us - bare_us}
+                    results.append(r)
+                    print(f"{r['name']:<28} bare {bare_us:7.2f} us   wrapped {wrapped_us:7.2f} us   "
+                          f"overhead {r['overhead_us']:7.2f} us", flush=True)
+    finally:
+        loop.close()
+
+    if args.output:
+        write_report(args.output, results)
+    if args.compare:
+        compare(results, args.compare, compare_row)
+
+
+if __name__ == "__main__":
+    main()
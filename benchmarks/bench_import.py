@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# benchmarks/bench_import.py
+"""
+Import-time benchmark for the envbanner package.
+
+Each scenario runs in fresh interpreters under ``python -X importtime``. Modules
+the bare interpreter already loads are subtracted, so the figure is what the
+statement itself costs. Some scenarios also list modules that must stay
+unloaded; a violation fails the run, which keeps the lazy imports honest:
+
+    python benchmarks/bench_import.py --output before.json
+    git checkout my-branch
+    python benchmarks/bench_import.py --output after.json --compare before.json
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+from common import compare, write_report
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (name, statement, modules that must not be imported by it)
+SCENARIOS = [
+    ("import", "import envbanner",
+     ["envbanner.core", "envbanner.middleware", "envbanner.adapters", "envbanner.metrics"]),
+    ("classify_env", "from envbanner import classify_env; classify_env(env_var='dev', host=None, path=None)",
+     ["envbanner.middleware", "envbanner.adapters", "envbanner.streamlit_adapter", "html", "json"]),
+    ("classify_host", "from envbanner import classify_env; classify_env(env_var=None, host='app.stg.example.com', path='/')",
+     ["envbanner.middleware", "html", "json"]),
+    ("build_banner_html", "from envbanner import build_banner_html; build_banner_html({'env': 'dev'})",
+     ["envbanner.middleware", "json"]),
+    ("middleware", "from envbanner import WSGIBannerMiddleware, ASGIBannerMiddleware",
+     ["hashlib", "tempfile"]),
+]
+
+
+def import_times(statement: str):
+    """Runs ``statement`` under -X importtime; returns {module: self microseconds}."""
+    env = {**os.environ, "PYTHONPATH": ROOT + os.pathsep + os.environ.get("PYTHONPATH", "")}
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                         capture_output=True, text=True, env=env, check=True)
+    times = {}
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line: continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit(): continue  # header line
+        times[name.strip()] = int(self_us)
+    return times
+
+
+def run_scenario(name, statement, forbidden, baseline, repeat):
+    totals, modules = [], {}
+    for _ in range(repeat):
+        times = import_times(statement)
+        modules = {m: us for m, us in times.items() if m not in baseline}
+        totals.append(sum(modules.values()))
+    loaded = set(modules)
+    return {
+        "name": name,
+        "statement": statement,
+        "median_us": statistics.median(totals),
+        "min_us": min(totals),
+        "modules": len(modules),
+        "slowest": sorted(modules.items(), key=lambda kv: -kv[1])[:5],
+        "violations": sorted(m for m in forbidden if m in loaded),
+    }
+
+
+def compare_row(old, r) -> str:
+    return (f"{r['name']:<20} {old['median_us'] / 1000:8.2f} -> {r['median_us'] / 1000:8.2f} ms   "
+            f"modules {old['modules']:4d} -> {r['modules']:4d}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--repeat", type=int, default=7, help="fresh interpreters per scenario")
+    parser.add_argument("--scenarios", nargs="+", choices=[s[0] for s in SCENARIOS])
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    baseline = set(import_times("pass"))
+    results = []
+    for name, statement, forbidden in SCENARIOS:
+        if args.scenarios and name not in args.scenarios: continue
+        r = run_scenario(name, statement, forbidden, baseline, args.repeat)
+        results.append(r)
+        slowest = ", ".join(f"{m} {us / 1000:.1f}" for m, us in r["slowest"][:3])
+        print(f"{name:<20} {r['median_us'] / 1000:8.2f} ms  {r['modules']:4d} modules   slowest: {slowest}")
+        if r["violations"]:
+            print(f"{'':<20} unexpectedly imported: {', '.join(r['violations'])}")
+
+    if args.output:
+        write_report(args.output, results)
+    if args.compare:
+        compare(results, args.compare, compare_row)
+    return 1 if any(r["violations"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# benchmarks/bench_loop_lag.py
+"""
+Event-loop lag of ASGIBannerMiddleware under concurrent large-page load.
+
+A ticker task sleeps for --tick seconds in a loop and records how late it wakes
+up, which is what every other connection on the worker would feel. Meanwhile
+--concurrency clients fetch pages of each size through the middleware, once
+with injection on the loop (offload_bytes=None) and once offloaded to the
+default thread pool. Each case reports p50/p99/max lag and pages per second:
+
+    python benchmarks/bench_loop_lag.py --sizes 1048576 10485760 --output lag.json
+"""
+import argparse
+import asyncio
+import gzip
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from envbanner.middleware import ASGIBannerMiddleware, OFFLOAD_BYTES
+from common import percentile, write_report
+
+KB = 1024
+MB = 1024 * KB
+DEFAULT_SIZES = [256 * KB, 1 * MB, 10 * MB]
+
+
+def make_page(size: int) -> bytes:
+    # Varied words keep gzip near the ratio of real HTML rather than a repeated line's.
+    rnd = random.Random(size)
+    words = ["".join(rnd.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rnd.randint(2, 10)))
+             for _ in range(2000)]
+    head = "<!DOCTYPE html><html><head><title>bench</title></head><body>"
+    tail = "</body></html>"
+    lines, total = [], len(head) + len(tail)
+    while total < size:
+        line = "<p>" + " ".join(rnd.choices(words, k=12)) + "</p>\n"
+        lines.append(line)
+        total += len(line)
+    return (head + "".join(lines)[:max(size - len(head) - len(tail), 0)] + tail).encode()
+
+
+def make_app(body: bytes, encoding: str):
+    headers = [(b"content-type", b"text/html; charset=utf-8"), (b"content-length", str(len(body)).encode())]
+    if encoding: headers.append((b"content-encoding", encoding.encode()))
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": list(headers)})
+        await send({"type": "http.response.body", "body": body})
+    return app
+
+
+async def measure(middleware, requests: int, concurrency: int, tick: float):
+    lags = []
+    stop = asyncio.Event()
+
+    async def ticker():
+        loop = asyncio.get_running_loop()
+        while not stop.is_set():
+            t0 = loop.time()
+            await asyncio.sleep(tick)
+            lags.append(loop.time() - t0 - tick)
+
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": [(b"host", b"app.staging.example.com")]}
+    queue = asyncio.Queue()
+    for _ in range(requests): queue.put_nowait(None)
+
+    async def client():
+        async def send(message):
+            await asyncio.sleep(0)  # a real server yields while writing to the socket
+        while not queue.empty():
+            queue.get_nowait()
+            await middleware(scope, None, send)
+
+    tick_task = asyncio.ensure_future(ticker())
+    await asyncio.sleep(tick * 2)
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await tick_task
+    return lags, elapsed
+
+
+def run_case(size: int, encoding: str, offload: bool, args):
+    body = make_page(size)
+    if encoding == "gzip": body = gzip.compress(body, 6)
+    middleware = ASGIBannerMiddleware(make_app(body, encoding),
+                                      offload_bytes=args.offload_bytes if offload else None)
+    requests = max(args.concurrency, min(args.requests, args.budget // max(size, 1)))
+    lags, elapsed = asyncio.run(measure(middleware, requests, args.concurrency, args.tick))
+    return {
+        "name": f"{'gzip' if encoding else 'plain'}/{size}B/{'offload' if offload else 'inline'}",
+        "size": size, "encoding": encoding, "offload": offload, "requests": requests,
+        "pages_per_second": requests / elapsed,
+        "lag_p50_ms": percentile(lags, 50) * 1e3,
+        "lag_p99_ms": percentile(lags, 99) * 1e3,
+        "lag_max_ms": max(lags, default=0.0) * 1e3,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="page sizes in bytes")
+    parser.add_argument("--encodings", nargs="+", default=["plain", "gzip"], choices=["plain", "gzip"])
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=200, help="max pages per case")
+    parser.add_argument("--budget", type=int, default=512 * MB,
+                        help="approximate bytes pushed through each case; caps requests for big pages")
+    parser.add_argument("--tick", type=float, default=0.001, help="ticker interval in seconds")
+    parser.add_argument("--offload-bytes", type=int, default=OFFLOAD_BYTES,
+                        help="threshold used for the offloaded runs")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ.pop("APP_ENV", None)
+    os.environ.pop("ENVBANNER_ENV", None)
+    results = []
+    for encoding in args.encodings:
+        for size in args.sizes:
+            for offload in (False, True):
+                r = run_case(size, "" if encoding == "plain" else encoding, offload, args)
+                results.append(r)
+                print(f"{r['name']:<32} {r['pages_per_second']:9.1f} pages/s   lag p50 {r['lag_p50_ms']:7.2f} ms"
+                      f"   p99 {r['lag_p99_ms']:7.2f} ms   max {r['lag_max_ms']:7.2f} ms", flush=True)
+
+    if args.output:
+        write_report(args.output, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# benchmarks/bench_middleware.py
+"""
+Offline throughput, latency and memory benchmarks for the banner middlewares.
+
+WSGIBannerMiddleware and ASGIBannerMiddleware are driven in-process with synthetic
+apps and compared against the bare app. Results are written as JSON so runs can
+be compared between commits:
+
+    python benchmarks/bench_middleware.py --output before.json
+    git checkout my-branch
+    python benchmarks/bench_middleware.py --output after.json --compare before.json
+
+Use --sizes/--chunks/--stacks to narrow the matrix; 50 MB pages take a while.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from envbanner.middleware import WSGIBannerMiddleware, ASGIBannerMiddleware
+from common import compare, percentile, write_report
+
+KB = 1024
+MB = 1024 * KB
+DEFAULT_SIZES = [1 * KB, 100 * KB, 1 * MB, 10 * MB, 50 * MB]
+CONTENT_TYPES = {"html": "text/html; charset=utf-8", "json": "application/json"}
+
+
+def make_body(size: int, kind: str) -> bytes:
+    if kind == "json":
+        head, tail = b'{"data": "', b'"}'
+    else:
+        head = b"<!DOCTYPE html><html><head><title>bench</title></head><body>"
+        tail = b"</body></html>"
+    filler = size - len(head) - len(tail)
+    line = b"<p>lorem ipsum dolor sit amet</p>\n" if kind == "html" else b"x" * 64
+    body = (line * (filler // len(line) + 1))[:max(filler, 0)]
+    return head + body + tail
+
+
+def split(body: bytes, chunks: int):
+    step = max(1, -(-len(body) // chunks))
+    return [body[i:i + step] for i in range(0, len(body), step)] or [b""]
+
+
+def wsgi_app(parts, content_type):
+    length = str(sum(len(p) for p in parts))
+    headers = [("Content-Type", content_type), ("Content-Length", length)]
+
+    def app(environ, start_response):
+        start_response("200 OK", list(headers))
+        return parts
+    return app
+
+
+def asgi_app(parts, content_type):
+    length = str(sum(len(p) for p in parts)).encode()
+    headers = [(b"content-type", content_type.encode()), (b"content-length", length)]
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": list(headers)})
+        last = len(parts) - 1
+        for i, part in enumerate(parts):
+            await send({"type": "http.response.body", "body": part, "more_body": i < last})
+    return app
+
+
+def wsgi_runner(app):
+    environ = {"REQUEST_METHOD": "GET", "PATH_INFO": "/", "HTTP_HOST": "bench.dev.example.com"}
+
+    def start_response(status, headers, exc_info=None):
+        return lambda data: None
+
+    def run():
+        result = app(environ, start_response)
+        try:
+            for _ in result:
+                pass
+        finally:
+            if hasattr(result, "close"): result.close()
+    return run
+
+
+def asgi_runner(app, loop):
+    scope = {"type": "http", "method": "GET", "path": "/",
+             "headers": [(b"host", b"bench.dev.example.com")]}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    def run():
+        loop.run_until_complete(app(scope, receive, send))
+    return run
+
+
+def time_runs(run, iterations: int):
+    run()  # warm caches
+    samples = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        run()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def peak_alloc(run) -> int:
+    tracemalloc.start()
+    try:
+        run()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def build(stack, parts, content_type, loop, stream):
+    if stack == "wsgi":
+        bare = wsgi_app(parts, content_type)
+        return wsgi_runner(bare), wsgi_runner(WSGIBannerMiddleware(bare, stream=stream))
+    bare = asgi_app(parts, content_type)
+    return asgi_runner(bare, loop), asgi_runner(ASGIBannerMiddleware(bare), loop)
+
+
+def run_scenario(stack, size, chunks, env, kind, stream, args, loop):
+    os.environ["APP_ENV"] = env  # read once, at middleware construction
+    body = make_body(size, kind)
+    bare, wrapped = build(stack, split(body, chunks), CONTENT_TYPES[kind], loop, stream)
+    iterations = max(args.min_iterations, min(args.iterations, args.budget // max(size, 1)))
+
+    bare_samples = time_runs(bare, iterations)
+    wrapped_samples = time_runs(wrapped, iterations)
+    name = f"{stack}{'-stream' if stream else ''}/{kind}/{env}/{size}B/{chunks}chunks"
+    return {
+        "name": name,
+        "stack": stack, "stream": stream, "kind": kind, "env": env,
+        "size": size, "chunks": chunks, "iterations": iterations,
+        "rps": iterations / sum(wrapped_samples),
+        "bare_rps": iterations / sum(bare_samples),
+        "p50_overhead_us": (percentile(wrapped_samples, 50) - percentile(bare_samples, 50)) * 1e6,
+        "p99_overhead_us": (percentile(wrapped_samples, 99) - percentile(bare_samples, 99)) * 1e6,
+        "peak_alloc_bytes": peak_alloc(wrapped),
+        "bare_peak_alloc_bytes": peak_alloc(bare),
+    }
+
+
+def compare_row(old, r) -> str:
+    change = (r["rps"] / old["rps"] - 1) * 100
+    return (f"{r['name']:<48} rps {change:+7.1f}%   "
+            f"p50 overhead {old['p50_overhead_us']:9.1f} -> {r['p50_overhead_us']:9.1f} us   "
+            f"peak {old['peak_alloc_bytes'] / MB:8.2f} -> {r['peak_alloc_bytes'] / MB:8.2f} MB")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="page sizes in bytes")
+    parser.add_argument("--chunks", type=int, nargs="+", default=[1, 64], help="body chunk counts")
+    parser.add_argument("--stacks", nargs="+", default=["wsgi", "wsgi-stream", "asgi"],
+                        choices=["wsgi", "wsgi-stream", "asgi"])
+    parser.add_argument("--envs", nargs="+", default=["dev", "prod"])
+    parser.add_argument("--kinds", nargs="+", default=["html", "json"], choices=sorted(CONTENT_TYPES))
+    parser.add_argument("--iterations", type=int, default=500, help="max iterations per scenario")
+    parser.add_argument("--min-iterations", type=int, default=5)
+    parser.add_argument("--budget", type=int, default=256 * MB,
+                        help="approximate bytes pushed through each scenario; caps iterations for big pages")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    loop = asyncio.new_event_loop()
+    results = []
+    try:
+        for stack_name in args.stacks:
+            stack, stream = stack_name.split("-")[0], stack_name.endswith("-stream")
+            for kind in args.kinds:
+                for env in args.envs:
+                    for size in args.sizes:
+                        for chunks in args.chunks:
+                            r = run_scenario(stack, size, chunks, env, kind, stream, args, loop)
+                            results.append(r)
+                            print(f"{r['name']:<48} {r['rps']:12.1f} req/s   "
+                                  f"p50 +{r['p50_overhead_us']:9.1f} us   p99 +{r['p99_overhead_us']:9.1f} us   "
+                                  f"peak {r['peak_alloc_bytes'] / MB:8.2f} MB", flush=True)
+    finally:
+        loop.close()
+
+    if args.output:
+        write_report(args.output, results,
+                     max_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None)
+    if args.compare:
+        compare(results, args.compare, compare_row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# benchmarks/common.py
+"""
+Helpers shared by the benchmark scripts: percentiles, the JSON report written
+with --output, and the --compare table against a previous report.
+"""
+import json
+import os
+import platform
+import subprocess
+import time
+
+
+def percentile(values, pct: float) -> float:
+    if not values: return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def git_revision() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                             text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+
+def write_report(path: str, results, **extra) -> None:
+    """Writes ``results`` to ``path`` along with the revision and platform they were measured on."""
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        **extra,
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {len(results)} results to {path}")
+
+
+def compare(results, baseline_path: str, row) -> None:
+    """Prints ``row(old, new)`` for every result that also appears in the report at ``baseline_path``."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    print(f"\nCompared with {baseline_path}:")
+    for r in results:
+        old = baseline.get(r["name"])
+        if old: print("  " + row(old, r))
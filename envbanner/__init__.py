@@ -1,8 +1,19 @@
 # envbanner/__init__.py
-from .core import classify_env, build_banner_html
-from .middleware import WSGIBannerMiddleware, ASGIBannerMiddleware
-from .adapters import dash, flask
-from .streamlit_adapter import streamlit
+# Public names are resolved on first access, so `from envbanner import classify_env`
+# does not import the middleware, adapters or metrics modules.
+TYPE_CHECKING = False  # typing.TYPE_CHECKING without importing typing
+
+_EXPORTS = {
+    "classify_env": "core",
+    "build_banner_html": "core",
+    "WSGIBannerMiddleware": "middleware",
+    "ASGIBannerMiddleware": "middleware",
+    "dash": "adapters",
+    "flask": "adapters",
+    "streamlit": "streamlit_adapter",
+    "BannerMetrics": "metrics",
+    "warmup": "prefork",
+}
 
 __all__ = [
     "classify_env",
@@ -12,4 +23,27 @@ __all__ = [
     "dash",
     "flask",
     "streamlit",
+    "BannerMetrics",
+    "warmup",
 ]
+
+if TYPE_CHECKING:
+    from .core import classify_env, build_banner_html
+    from .middleware import WSGIBannerMiddleware, ASGIBannerMiddleware
+    from .adapters import dash, flask
+    from .streamlit_adapter import streamlit
+    from .metrics import BannerMetrics
+    from .prefork import warmup
+del TYPE_CHECKING  # only for the block above; not part of the package's namespace
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    __import__(f"{__name__}.{module}")
+    value = getattr(globals()[module], name)
+    globals()[name] = value  # later lookups skip this hook
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,12 +1,23 @@
 # envbanner/adapters.py
 import os
 from typing import Dict, Any
-from .core import classify_env, build_banner_html
+from .core import SNIPPET_CACHE_SIZE, classify_env, build_banner_html, is_prod, _norm_env
+
+def _inject_index(index_string: str, snippet: str) -> str:
+    needle = "</body>"
+    if needle in index_string.lower():
+        parts = index_string.rsplit(needle, 1)
+        return parts[0] + snippet + needle + parts[1]
+    return index_string + snippet
 
 def dash(app, env_var_name: str = "APP_ENV", **options):
     """
     Patches Dash's index_string to include the banner.
 
+    The index string carries a host-less banner. When the banner depends on the
+    request (no explicit env var, or show_host), app.interpolate_index is wrapped
+    to swap in a per-host banner, cached per host, on each page load.
+
     Args:
         app: Dash application instance
         env_var_name: Primary environment variable to check (default: "APP_ENV")
@@ -19,29 +30,48 @@ def dash(app, env_var_name: str = "APP_ENV", **options):
             - opacity: Banner opacity 0.0-1.0
     """
     env_var = os.getenv(env_var_name) or os.getenv("ENVBANNER_ENV")
-    # For Dash, we don't know host at startup, so classify based on env var only.
-    # The 'auto' mode will show a default 'dev' banner.
+    # The host is unknown at startup, so the static banner is classified on the
+    # env var only; the 'auto' mode shows a default 'dev' banner.
     env = classify_env(env_var=env_var, host=None, path=None)
+    if is_prod(env):
+        return
 
-    banner_options = {**options, "env": env, "host": None}
-    snippet = build_banner_html(banner_options)
+    snippet = build_banner_html({**options, "env": env, "host": None})
+    app.index_string = _inject_index(app.index_string, snippet)
 
-    # Inject snippet before </body>
-    original_index_string = app.index_string
-    needle = "</body>"
-    if needle in original_index_string.lower():
-        parts = original_index_string.rsplit(needle, 1)
-        app.index_string = parts[0] + snippet + needle + parts[1]
-    else:
-        app.index_string = original_index_string + snippet
+    env_from_host = _norm_env(env_var) in (None, "auto")
+    if not (env_from_host or options.get("show_host", True)):
+        return  # the same banner for every host: the static index string is enough
+
+    from flask import request
+    original_interpolate = app.interpolate_index
+    # host -> banner for that host; bounded because Host comes from the client.
+    variants = {}
+
+    def interpolate_index(**kwargs):
+        html = original_interpolate(**kwargs)
+        host = request.host
+        variant = variants.get(host)
+        if variant is None:
+            host_env = classify_env(env_var=env_var, host=host, path=None)
+            variant = build_banner_html({**options, "env": host_env, "host": host})
+            if len(variants) < SNIPPET_CACHE_SIZE: variants[host] = variant
+        return html.replace(snippet, variant, 1) if variant != snippet else html
+
+    app.interpolate_index = interpolate_index
 
-def flask(app, env_var_name: str = "APP_ENV", **options):
+def flask(app, env_var_name: str = "APP_ENV", mode: str = "middleware", **options):
     """
     Wraps a Flask app's WSGI application with the banner middleware.
 
+    With mode='template' nothing is wrapped. Instead an ``envbanner()`` template
+    global is registered, and templates place the banner themselves with
+    ``{{ envbanner() }}``, so responses are never scanned or rewritten.
+
     Args:
         app: Flask application instance
         env_var_name: Primary environment variable to check (default: "APP_ENV")
+        mode: 'middleware' (default) or 'template'
         **options: Additional banner options:
             - text: Custom banner text
             - background: Custom background color (hex)
@@ -50,5 +80,35 @@ def flask(app, env_var_name: str = "APP_ENV", **options):
             - show_host: Whether to show hostname (default: True)
             - opacity: Banner opacity 0.0-1.0
     """
+    if mode not in ("middleware", "template"):
+        raise ValueError(f"mode must be 'middleware' or 'template', not {mode!r}")
+    env_var = os.getenv(env_var_name) or os.getenv("ENVBANNER_ENV")
+    prod = is_prod(classify_env(env_var=env_var, host=None, path=None))
+    if mode == "template":
+        app.add_template_global(_template_banner(env_var, prod, options), "envbanner")
+        return
+    if prod:
+        # Production: leave the bare WSGI app in place so requests pay nothing.
+        return
+
     from .middleware import WSGIBannerMiddleware
     app.wsgi_app = WSGIBannerMiddleware(app.wsgi_app, env_var_name=env_var_name, **options)
+
+def _template_banner(env_var, prod: bool, options: Dict[str, Any]):
+    """Returns the ``envbanner()`` template global for flask(mode='template')."""
+    from flask import has_request_context, request
+    from markupsafe import Markup
+
+    if prod:
+        # Templates still call envbanner(); give them nothing to render.
+        empty = Markup("")
+        return lambda: empty
+
+    def envbanner():
+        host = request.host if has_request_context() else None
+        path = request.path if host else None
+        env = classify_env(env_var=env_var, host=host, path=path)
+        # Both steps are cached, so a render costs two lookups.
+        return Markup(build_banner_html({**options, "env": env, "host": host}))
+
+    return envbanner
@@ -0,0 +1,211 @@
+"""
+Build-time banner injection for static sites (Sphinx, MkDocs, SPA exports).
+
+    envbanner build/html --env staging --position top-right
+
+Every .html/.htm file under the root gets the banner before its last </body>.
+Files that already carry the banner are left alone, and a manifest of
+(mtime, size) per file, kept in the user cache directory rather than in the
+published tree, lets repeated runs skip everything unchanged since.
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+from .core import classify_env, build_banner_html, is_prod
+from .middleware import _rfind_close_body
+
+HTML_SUFFIXES = (".html", ".htm")
+# Files at least this big are scanned through mmap instead of being read whole.
+MMAP_THRESHOLD = 1024 * 1024
+_MARKER = b'id="env-banner-bar"'
+# Below this many files a process pool costs more than it saves.
+_PARALLEL_MIN_FILES = 64
+
+def _scan(root: str) -> List[Tuple[str, int, int]]:
+    """Returns (path, mtime_ns, size) for every HTML file under ``root``."""
+    found = []
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.lower().endswith(HTML_SUFFIXES) and entry.is_file():
+                    st = entry.stat()
+                    found.append((entry.path, st.st_mtime_ns, st.st_size))
+    return found
+
+def _write_injected(path: str, data, offset: int, snippet: bytes) -> None:
+    """Writes ``data`` with ``snippet`` spliced in at ``offset`` (-1: appended), atomically."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".envbanner-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            if offset == -1:
+                out.write(data)
+                out.write(snippet)
+            else:
+                view = memoryview(data)
+                out.write(view[:offset])
+                out.write(snippet)
+                out.write(view[offset:])
+                view.release()
+        shutil.copymode(path, tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def inject_file(path: str, snippet: bytes) -> Tuple[str, str]:
+    """
+    Injects ``snippet`` into one HTML file in place.
+
+    Returns (path, outcome) where outcome is 'injected', 'skipped' (already has a
+    banner) or an error message.
+    """
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < MMAP_THRESHOLD:
+                return path, _inject_data(path, f.read(), snippet)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return path, _inject_data(path, data, snippet)
+    except (OSError, ValueError) as e:
+        return path, f"error: {e}"
+
+def _inject_data(path: str, data, snippet: bytes) -> str:
+    if data.find(_MARKER) != -1: return "skipped"
+    if data[:2] in (b"\xff\xfe", b"\xfe\xff"):
+        return "error: UTF-16 files are not supported"
+    _write_injected(path, data, _rfind_close_body(data), snippet)
+    return "injected"
+
+def default_manifest(root: str) -> str:
+    """Returns the manifest path for ``root`` in the user cache directory, outside the tree."""
+    cache = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    key = hashlib.sha256(os.path.realpath(root).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache, "envbanner", f"manifest-{key}.json")
+
+def _load_manifest(path: str, key: str) -> Dict[str, List[int]]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # A different banner means a different run: start over.
+    if not isinstance(manifest, dict) or manifest.get("snippet") != key:
+        return {}
+    files = manifest.get("files")
+    return files if isinstance(files, dict) else {}
+
+def _save_manifest(path: str, key: str, files: Dict[str, List[int]]) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"snippet": key, "files": files}, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+def inject_tree(root: str, snippet: str, jobs: Optional[int] = None,
+                manifest: Optional[str] = None, force: bool = False) -> Dict[str, int]:
+    """
+    Injects ``snippet`` into every HTML file under ``root``.
+
+    Args:
+        root: Directory to walk
+        snippet: Banner HTML, usually from build_banner_html
+        jobs: Worker processes (default: os.cpu_count(); 1 runs in-process)
+        manifest: Manifest file (see default_manifest); None (default) disables it. Keep it
+                  out of ``root``, or it gets published along with the site.
+        force: Ignore the manifest and look at every file again
+
+    Returns:
+        Counts per outcome: injected, skipped, unchanged, errors
+    """
+    # Character references read the same in every ASCII-compatible charset, so
+    # pages that are not UTF-8 get no mojibake from the banner's non-ASCII text.
+    snippet_bytes = snippet.encode("ascii", "xmlcharrefreplace")
+    key = hashlib.sha256(snippet_bytes).hexdigest()[:16]
+    seen = {} if force or manifest is None else _load_manifest(manifest, key)
+
+    files = _scan(root)
+    todo = []
+    counts = {"injected": 0, "skipped": 0, "unchanged": 0, "errors": 0}
+    recorded = {}
+    for path, mtime_ns, size in files:
+        rel = os.path.relpath(path, root)
+        if seen.get(rel) == [mtime_ns, size]:
+            counts["unchanged"] += 1
+            recorded[rel] = [mtime_ns, size]
+        else:
+            todo.append(path)
+
+    def record(results):
+        for path, outcome in results:
+            if outcome.startswith("error"):
+                counts["errors"] += 1
+                print(f"{path}: {outcome}", file=sys.stderr)
+                continue
+            counts[outcome] += 1
+            st = os.stat(path)
+            recorded[os.path.relpath(path, root)] = [st.st_mtime_ns, st.st_size]
+
+    work = partial(inject_file, snippet=snippet_bytes)
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(todo) < _PARALLEL_MIN_FILES:
+        record(map(work, todo))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            record(pool.map(work, todo, chunksize=max(1, min(256, len(todo) // (jobs * 4)))))
+
+    if manifest is not None:
+        _save_manifest(manifest, key, recorded)
+    return counts
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="envbanner", description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("root", help="directory containing the built HTML")
+    parser.add_argument("--env", help="environment (default: $APP_ENV, $ENVBANNER_ENV, then --host rules)")
+    parser.add_argument("--host", help="hostname used for classification and shown in the banner")
+    parser.add_argument("--text", help="custom banner text")
+    parser.add_argument("--background", help="custom background color (hex)")
+    parser.add_argument("--color", help="custom text color (hex)")
+    parser.add_argument("--position", help="banner position (default: bottom)")
+    parser.add_argument("--opacity", type=float, help="banner opacity 0.0-1.0")
+    parser.add_argument("--no-show-host", dest="show_host", action="store_false", help="hide the hostname")
+    parser.add_argument("-j", "--jobs", type=int, help="worker processes (default: CPU count)")
+    parser.add_argument("--manifest", help="incremental manifest file (default: one per root under ~/.cache/envbanner)")
+    parser.add_argument("--no-manifest", action="store_true", help="do not read or write a manifest")
+    parser.add_argument("--force", action="store_true", help="ignore the manifest and check every file")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if not os.path.isdir(args.root):
+        print(f"envbanner: {args.root}: not a directory", file=sys.stderr)
+        return 2
+    env_var = args.env or os.getenv("APP_ENV") or os.getenv("ENVBANNER_ENV")
+    env = classify_env(env_var=env_var, host=args.host, path=None)
+    if is_prod(env):
+        print(f"envbanner: environment is {env}, nothing to inject")
+        return 0
+
+    options = {"env": env, "host": args.host, "show_host": args.show_host}
+    for name in ("text", "background", "color", "position", "opacity"):
+        value = getattr(args, name)
+        if value is not None: options[name] = value
+    manifest = None if args.no_manifest else args.manifest or default_manifest(args.root)
+    counts = inject_tree(args.root, build_banner_html(options), jobs=args.jobs,
+                         manifest=manifest, force=args.force)
+    print("envbanner: {injected} injected, {skipped} already bannered, "
+          "{unchanged} unchanged, {errors} errors".format(**counts))
+    return 1 if counts["errors"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,15 @@
 # envbanner/core.py
+from __future__ import annotations
+
 import os
-import re
-from html import escape
-from typing import Optional, Tuple, Dict, Any
+import time
+from functools import lru_cache
+
+TYPE_CHECKING = False  # typing stays unimported on the classify_env cold path
+if TYPE_CHECKING:
+    from typing import Optional, Tuple, Dict, Any
 
-# Map host/path to env buckets; override with ENVBANNER_MAP if needed.
+# Map host/path to env buckets; extend with ENVBANNER_MAP if needed (see load_rules).
 DEFAULT_RULES = [
     # dev/local/test
     (r"(localhost|127\.0\.0\.1|\.local$)", "dev"),
@@ -32,12 +37,159 @@ def _norm_env(value: Optional[str]) -> Optional[str]:
     v = value.strip().lower()
     return ENV_NORMS.get(v, v)
 
+# Distinct hosts remembered per rule set.
+CLASSIFY_CACHE_SIZE = 1024
+
+# How often (seconds) an ENVBANNER_MAP file is checked for changes.
+MAP_CHECK_INTERVAL = 5.0
+
+def _compile_rules(rules):
+    """
+    Compiles (pattern, env) rules into a single regex plus the env of each rule.
+
+    Every rule becomes a lookahead followed by an empty named group ``r<index>``,
+    and the alternatives are tried in list order from the start of the text, so
+    the first matching rule wins exactly as with one ``re.search`` per rule.
+    """
+    import re
+    alternatives = [f"(?=.*?(?:{pattern}))(?P<r{i}>)" for i, (pattern, _) in enumerate(rules)]
+    return re.compile("|".join(alternatives), re.DOTALL), tuple(env for _, env in rules)
+
+def _strip_port(host: str) -> str:
+    name, sep, port = host.rpartition(":")
+    return name if sep and port.isdigit() else host
+
+class _RuleSet:
+    """Immutable snapshot of the classification rules; replaced wholesale on reload."""
+    __slots__ = ("hosts", "custom", "regex", "envs", "classify", "path", "mtime")
+
+    def __init__(self, hosts: Dict[str, str], custom=(), path: Optional[str] = None, mtime: Optional[float] = None):
+        self.hosts = hosts
+        # Custom rules are compiled regexes searched one by one, so inline flags,
+        # backreferences and named groups behave as in a plain re.search; only
+        # DEFAULT_RULES, which are known to combine safely, share one regex.
+        self.custom = tuple(custom)
+        self.regex, self.envs = _compile_rules(DEFAULT_RULES)
+        self.classify = lru_cache(maxsize=CLASSIFY_CACHE_SIZE)(self._classify)
+        self.path = path
+        self.mtime = mtime
+
+    def _classify(self, text: str) -> str:
+        for regex, env in self.custom:
+            if regex.search(text): return env
+        m = self.regex.match(text)
+        return self.envs[int(m.lastgroup[1:])] if m else "unknown"
+
+def _map_file() -> Tuple[Optional[str], Optional[float]]:
+    """Returns the ENVBANNER_MAP file path and its mtime (None if missing); (None, None) for inline JSON."""
+    value = (os.getenv("ENVBANNER_MAP") or "").strip()
+    if not value or value.startswith(("{", "[")): return None, None
+    try:
+        return value, os.stat(value).st_mtime
+    except OSError:
+        return value, None
+
+def _compile_custom(rules):
+    """Compiles custom (pattern, env) rules one by one, warning about and skipping bad ones."""
+    import re
+    compiled = []
+    for pattern, env in rules:
+        try:
+            compiled.append((re.compile(pattern), env))
+        except (re.error, TypeError) as exc:
+            import warnings
+            warnings.warn(f"envbanner: ignoring ENVBANNER_MAP rule {pattern!r}: {exc}")
+    return compiled
+
+def load_rules() -> _RuleSet:
+    """
+    Builds a rule snapshot from ENVBANNER_MAP and DEFAULT_RULES.
+
+    ENVBANNER_MAP holds inline JSON or the path to a JSON file, either:
+        - {"hosts": {"tenant.example.com": "staging"}, "rules": [["pattern", "dev"]]}
+        - {"tenant.example.com": "staging", ...}  (exact hostnames only)
+        - [["pattern", "dev"], ...]  (regex rules only)
+    Exact hostnames are looked up in a dict before any regex runs; custom rules
+    are tried before DEFAULT_RULES.
+    """
+    value = (os.getenv("ENVBANNER_MAP") or "").strip()
+    if not value:
+        return _RuleSet({})
+
+    path = mtime = None
+    text = value
+    if not value.startswith(("{", "[")):
+        path = value
+        mtime = os.stat(path).st_mtime
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+
+    import json
+    data = json.loads(text)
+    if isinstance(data, list):
+        hosts, rules = {}, data
+    elif isinstance(data, dict) and ("hosts" in data or "rules" in data):
+        hosts, rules = data.get("hosts", {}), data.get("rules", [])
+    elif isinstance(data, dict):
+        hosts, rules = data, []
+    else:
+        raise ValueError("ENVBANNER_MAP must be a JSON object or list")
+
+    hosts = {h.strip().lower(): _norm_env(e) for h, e in hosts.items()}
+    rules = [(pattern, _norm_env(e)) for pattern, e in rules]
+    return _RuleSet(hosts, _compile_custom(rules), path, mtime)
+
+_ruleset: Optional[_RuleSet] = None
+_next_map_check = 0.0
+
+def reload_rules() -> None:
+    """
+    Re-reads ENVBANNER_MAP and swaps in the new snapshot with a single assignment,
+    so request threads never wait on a lock. Safe to call from a signal handler.
+    If the map is invalid, a warning is issued and the previous rules stay active.
+    """
+    import re
+    import warnings
+    global _ruleset
+    try:
+        _ruleset = load_rules()
+    except (OSError, ValueError, TypeError, AttributeError, re.error) as exc:
+        warnings.warn(f"envbanner: ignoring invalid ENVBANNER_MAP: {exc}")
+        if _ruleset is None:
+            # Keep watching the map file, so fixing or creating it still takes effect.
+            _ruleset = _RuleSet({}, (), *_map_file())
+
+def _current_rules() -> _RuleSet:
+    global _next_map_check
+    if _ruleset is None:
+        reload_rules()
+    elif _ruleset.path is not None and time.monotonic() >= _next_map_check:
+        _next_map_check = time.monotonic() + MAP_CHECK_INTERVAL
+        try:
+            changed = os.stat(_ruleset.path).st_mtime != _ruleset.mtime
+        except OSError:
+            changed = False
+        if changed:
+            reload_rules()
+    return _ruleset
+
 def classify_from_host_path(host: str, path: str) -> str:
-    text = f"{host}{path}".lower()
-    for pattern, env in DEFAULT_RULES:
-        if re.search(pattern, text):
+    rules = _current_rules()
+    host = host.lower()
+    if rules.hosts:
+        env = rules.hosts.get(host) or rules.hosts.get(_strip_port(host))
+        if env:
             return env
-    return "unknown"
+    # Hosts are cached; the path only matters when the host says nothing, and then
+    # all of it is matched, uncached, since URLs are unbounded.
+    env = rules.classify(host)
+    if env == "unknown" and path not in ("", "/"):
+        env = rules._classify(host + path.lower())
+    return env
+
+def classification_cache_info():
+    """Returns hits/misses/maxsize/currsize of the current rule set's cache."""
+    return _current_rules().classify.cache_info()
 
 def classify_env(*, env_var: Optional[str], host: Optional[str], path: Optional[str]) -> str:
     # 1) Explicit env var wins if provided
@@ -72,9 +224,18 @@ def banner_label(env: str) -> str:
     if env == "unknown": return "NON-PROD (UNKNOWN)"
     return env.upper()
 
+# Every value build_banner_html accepts for ``position``.
+POSITIONS = ("bottom", "top", "top-left", "top-right", "bottom-left", "bottom-right",
+             "diagonal", "diagonal-tlbr", "diagonal-bltr")
+
+# Rendered snippets kept by build_banner_html. Bounded because the host part of
+# the key comes from the untrusted Host header.
+SNIPPET_CACHE_SIZE = 512
+
 def build_banner_html(options: Dict[str, Any]) -> str:
     """
     Generates the complete HTML and CSS for the banner based on options.
+    Results are cached on (env, host, options), so repeated calls are a dict lookup.
 
     Args:
         options: Dictionary with the following keys:
@@ -88,15 +249,62 @@ def build_banner_html(options: Dict[str, Any]) -> str:
                                        'diagonal', 'diagonal-tlbr', 'diagonal-bltr')
             - show_host: Optional[bool] - Whether to show hostname (default: True)
             - opacity: Optional[float] - Banner opacity 0.0-1.0 (default: 1.0 for most, 0.5 for diagonal)
+            - css_href: Optional[str] - Link this stylesheet (see build_banner_css) instead of
+                                       inlining a <style> block
 
     Returns:
         HTML string to be injected
     """
+    key = tuple(sorted(options.items()))
+    if not options.get("show_host", True):
+        # The host is not rendered, so it must not fragment the cache.
+        key = tuple(item for item in key if item[0] != "host")
+    try:
+        return _cached_banner_html(key)
+    except TypeError:  # unhashable option value
+        return _render_banner_html(options)
+
+@lru_cache(maxsize=SNIPPET_CACHE_SIZE)
+def _cached_banner_html(key) -> str:
+    return _render_banner_html(dict(key))
+
+@lru_cache(maxsize=SNIPPET_CACHE_SIZE)
+def encode_banner_html(snippet: str, charset: str) -> bytes:
+    """Returns ``snippet`` encoded for a response charset, cached per (snippet, charset)."""
+    return snippet.encode(charset, "replace")
+
+def _render_banner_html(options: Dict[str, Any]) -> str:
+    from html import escape
+    css, before, after = _banner_parts(options)
+    if not after:
+        return ""
+    href = options.get("css_href")
+    style = f'<link rel="stylesheet" href="{escape(href)}">' if href else f"<style>{css}</style>"
+    return f"{before}{style}{after}"
+
+def build_banner_css(options: Dict[str, Any]) -> str:
+    """
+    Returns only the banner's CSS for the given options (the host is irrelevant),
+    so it can be served as a cacheable stylesheet instead of inlined per page.
+    """
+    key = tuple(sorted(item for item in options.items() if item[0] not in ("host", "text", "show_host", "css_href")))
+    try:
+        return _cached_banner_css(key)
+    except TypeError:  # unhashable option value
+        return _banner_parts(options)[0]
+
+@lru_cache(maxsize=64)
+def _cached_banner_css(key) -> str:
+    return _banner_parts(dict(key))[0]
+
+def _banner_parts(options: Dict[str, Any]) -> Tuple[str, str, str]:
+    """Returns (css, markup before the style, markup after it); all empty for prod."""
     env = options.get("env", "dev")
     host = options.get("host")
 
     if is_prod(env):
-        return ""
+        return "", "", ""
+    from html import escape
 
     # Determine text and colors: use custom options first, then fall back to defaults
     default_bg, default_fg = banner_palette(env)
@@ -131,7 +339,7 @@ def build_banner_html(options: Dict[str, Any]) -> str:
             background: {background}; color: {color}; text-transform: uppercase;
             opacity: {opacity};
         }}"""
-        return f'<div id="env-banner-bar"><style>{css}</style><div id="env-banner-bar-ribbon" role="status">{text}</div></div>'
+        return css, '<div id="env-banner-bar">', f'<div id="env-banner-bar-ribbon" role="status">{text}</div></div>'
 
     # Top-left corner ribbon
     if position == "top-left":
@@ -154,7 +362,7 @@ def build_banner_html(options: Dict[str, Any]) -> str:
             background: {background}; color: {color}; text-transform: uppercase;
             opacity: {opacity};
         }}"""
-        return f'<div id="env-banner-bar"><style>{css}</style><div id="env-banner-bar-ribbon" role="status">{text}</div></div>'
+        return css, '<div id="env-banner-bar">', f'<div id="env-banner-bar-ribbon" role="status">{text}</div></div>'
 
     # Bottom-right corner ribbon
     if position == "bottom-right":
@@ -177,7 +385,7 @@ def build_banner_html(options: Dict[str, Any]) -> str:
             background: {background}; color: {color}; text-transform: uppercase;
             opacity: {opacity};
         }}"""
-        return f'<div id="env-banner-bar"><style>{css}</style><div id="env-banner-bar-ribbon" role="status">{text}</div></div>'
+        return css, '<div id="env-banner-bar">', f'<div id="env-banner-bar-ribbon" role="status">{text}</div></div>'
 
     # Bottom-left corner ribbon
     if position == "bottom-left":
@@ -200,7 +408,7 @@ def build_banner_html(options: Dict[str, Any]) -> str:
             background: {background}; color: {color}; text-transform: uppercase;
             opacity: {opacity};
         }}"""
-        return f'<div id="env-banner-bar"><style>{css}</style><div id="env-banner-bar-ribbon" role="status">{text}</div></div>'
+        return css, '<div id="env-banner-bar">', f'<div id="env-banner-bar-ribbon" role="status">{text}</div></div>'
 
     # Diagonal banners: bottom-left to top-right (/) or top-left to bottom-right (\)
     if position in ("diagonal", "diagonal-tlbr", "diagonal-bltr"):
@@ -230,7 +438,7 @@ def build_banner_html(options: Dict[str, Any]) -> str:
             box-shadow: 0 2px 4px rgba(0,0,0,.3);
             pointer-events: none;
         }}"""
-        return f'<style>{css}</style><div id="env-banner-bar" role="status">{text}</div>'
+        return css, "", f'<div id="env-banner-bar" role="status">{text}</div>'
 
     # Default to bottom bar (or top if explicitly specified)
     opacity = options.get("opacity", 1.0)
@@ -257,4 +465,4 @@ def build_banner_html(options: Dict[str, Any]) -> str:
     }}
     #env-banner-bar {{ bottom: 0; top: auto; }} body {{ padding-bottom: 32px !important; }}"""
 
-    return f'<style>{css}</style><div id="env-banner-bar" role="status">{text}</div>'
+    return css, "", f'<div id="env-banner-bar" role="status">{text}</div>'
@@ -0,0 +1,74 @@
+# envbanner/metrics.py
+import threading
+from bisect import bisect_left
+from typing import Any, Callable, Dict
+
+# Histogram bucket upper bounds: seconds for "*_seconds", bytes for "*_bytes".
+SECONDS_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+BYTES_BUCKETS = (1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2)
+
+class BannerMetrics:
+    """
+    Prometheus-style counters and histograms for the banner middlewares.
+
+    Pass an instance as ``metrics=`` to WSGIBannerMiddleware/ASGIBannerMiddleware
+    and read ``snapshot()``. Any object with the same ``inc``/``observe`` methods,
+    e.g. a thin prometheus_client adapter, can be passed instead.
+
+    Counters:
+        - passthrough.<reason>: request (HEAD/Range), not_html, status, encoding,
+          too_large, prod, decode_error, file (ASGI pathsend/zerocopysend)
+        - injected.before_body / injected.body_start / injected.appended: whether
+          the injection point (</body>, or <body> with inject_at='body-start') was found
+        - offloaded: ASGI bodies or chunks injected in an executor (offload_bytes)
+    Histograms:
+        - classify_seconds, snippet_seconds, buffer_seconds, inject_seconds
+        - buffered_bytes: body bytes held in memory for one response
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, float] = {}
+        self.histograms: Dict[str, Dict[str, Any]] = {}
+
+    def inc(self, name: str, amount: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name: str, value: float) -> None:
+        bounds = BYTES_BUCKETS if name.endswith("_bytes") else SECONDS_BUCKETS
+        with self._lock:
+            h = self.histograms.get(name)
+            if h is None:
+                h = self.histograms[name] = {"bounds": bounds, "buckets": [0] * (len(bounds) + 1), "count": 0, "sum": 0.0}
+            h["buckets"][bisect_left(bounds, value)] += 1
+            h["count"] += 1
+            h["sum"] += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns a copy of all counters and histograms."""
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {k: {**h, "buckets": list(h["buckets"])} for k, h in self.histograms.items()},
+            }
+
+class CallbackMetrics:
+    """Adapts a ``callback(name, value)`` function to the metrics interface."""
+
+    def __init__(self, callback: Callable[[str, float], Any]):
+        self.callback = callback
+
+    def inc(self, name: str, amount: float = 1) -> None:
+        self.callback(name, amount)
+
+    def observe(self, name: str, value: float) -> None:
+        self.callback(name, value)
+
+def as_metrics(metrics):
+    """Returns ``metrics`` as an object with inc/observe, wrapping bare callables."""
+    if metrics is None or hasattr(metrics, "observe"):
+        return metrics
+    if callable(metrics):
+        return CallbackMetrics(metrics)
+    raise TypeError("metrics must provide inc()/observe() or be a callable(name, value)")
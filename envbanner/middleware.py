@@ -1,38 +1,695 @@
-# envbanner/middleware.py
-import re
+import codecs
 import os
-from typing import Optional, Dict, Any
-from .core import classify_env, build_banner_html, is_prod
+import zlib
+from functools import lru_cache
+from itertools import chain
+from time import perf_counter
+from typing import Optional, Dict, Any, Tuple
+from .core import classify_env, build_banner_html, build_banner_css, encode_banner_html, is_prod
+from .metrics import as_metrics
+
+# Bytes held back while streaming: enough to cover the tail of a document
+# from its closing </body> tag to the end.
+_STREAM_WINDOW = 64 * 1024
+_NEEDLE = b"</body"
+
+# Reserved path prefix for the banner stylesheet when css="link".
+CSS_PATH = "/__envbanner/"
+_CSS_NAME_PATTERN = r"banner-([a-z0-9_-]{1,32})\.([0-9a-f]{12})\.css"
+_CSS_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+@lru_cache(maxsize=None)
+def _regex(pattern):
+    """Compiles ``pattern`` on first use, so importing this module stays cheap."""
+    import re
+    return re.compile(pattern)
 
 def _inject_before(html: str, snippet: str, needle: str) -> str:
     i = html.lower().rfind(needle)
     if i == -1: return ""
     return html[:i] + snippet + html[i:]
 
-def _get_header(headers, name_bytes: bytes):
+_CLOSE_BODY_PATTERN = rb"(?i)</body"
+
+def _rfind_close_body(buf: bytes) -> int:
+    """Returns the offset of the last case-insensitive ``</body`` in ``buf``, or -1."""
+    # The closing tag is normally among the last few tags: walk those backwards,
+    # then fall back to one C-level forward scan for tag-dense chunks.
+    end = len(buf)
+    for _ in range(16):
+        i = buf.rfind(b"</", 0, end)
+        if i == -1: return -1
+        if buf[i + 2:i + 6].lower() == b"body": return i
+        end = i
+    i = -1
+    for m in _regex(_CLOSE_BODY_PATTERN).finditer(buf, 0, end + 5):
+        i = m.start()
+    return i
+
+@lru_cache(maxsize=64)
+def _is_ascii_compatible(charset: str) -> bool:
+    """True when ASCII markup keeps its byte values in ``charset``, so byte-level scanning is safe."""
+    try:
+        name = codecs.lookup(charset).name
+    except LookupError:
+        return False
+    # Stateful encodings reuse ASCII byte values inside shifted runs.
+    if name in ("utf-7", "hz") or name.startswith("iso2022"):
+        return False
+    return "</body>".encode(name) == b"</body>"
+
+def _inject_bytes(body: bytes, snippet: bytes) -> Tuple[bytes, bool]:
+    """
+    Splices ``snippet`` before the last ``</body`` of ``body`` (or appends it) with a
+    single copy. Returns the new body and whether the needle was found.
+    """
+    i = _rfind_close_body(body)
+    if i == -1: return body + snippet, False
+    view = memoryview(body)
+    return b"".join((view[:i], snippet, view[i:])), True
+
+BODY_END = "body-end"
+BODY_START = "body-start"
+_OPEN_BODY_PATTERN = rb"(?i)<body(?:[\s/][^>]*)?>"
+
+def _inject_bytes_after_open(body: bytes, snippet: bytes) -> Tuple[bytes, bool]:
+    """
+    Splices ``snippet`` right after the opening ``<body ...>`` tag. Without one it
+    goes where _inject_bytes puts it, and the second value is False.
+    """
+    m = _regex(_OPEN_BODY_PATTERN).search(body)
+    if m is None: return _inject_bytes(body, snippet)[0], False
+    i = m.end()
+    view = memoryview(body)
+    return b"".join((view[:i], snippet, view[i:])), True
+
+def _rfind_close_body_in_file(f, size: int, block: int = _STREAM_WINDOW) -> int:
+    """Scans a file backwards, block by block, for the last ``</body``; -1 if absent."""
+    overlap = len(_NEEDLE) - 1
+    end = size
+    while end > 0:
+        start = max(0, end - block)
+        f.seek(start)
+        i = _rfind_close_body(f.read(min(end + overlap, size) - start))
+        if i != -1: return start + i
+        end = start
+    return -1
+
+def _read_range(f, start: int, end: int, block: int = _STREAM_WINDOW):
+    f.seek(start)
+    while start < end:
+        data = f.read(min(block, end - start))
+        if not data: return
+        start += len(data)
+        yield data
+
+# ASGI injection work at least this big (in plain-body bytes) runs in an executor,
+# off the event loop. Splicing a plain body is a memcpy; decompressing and
+# recompressing costs about 64x that per byte, decoding a UTF-16 style page ~8x.
+OFFLOAD_BYTES = 4 * 1024 * 1024
+_ENCODED_COST = 64
+_DECODED_COST = 8
+
+def _injection_cost(size: int, charset: str, encoding: str) -> int:
+    if encoding: return size * _ENCODED_COST
+    return size if _is_ascii_compatible(charset) else size * _DECODED_COST
+
+# 2xx responses that never carry a full page body.
+_NO_INJECT_STATUSES = frozenset((204, 205, 206))
+# ASGI extensions that send the body straight from a file (scope["extensions"]).
+_FILE_SEND_TYPES = frozenset(("http.response.pathsend", "http.response.zerocopysend"))
+
+def _declared_length(value) -> Optional[int]:
+    if value is None: return None
+    value = value.strip()
+    # str.isdigit() also accepts digits such as "²" that int() refuses.
+    return int(value) if value.isascii() and value.isdigit() else None
+
+def _inject_body(body: bytes, snippet: str, charset: str, at: str = BODY_END) -> Tuple[bytes, bool]:
+    if _is_ascii_compatible(charset):
+        inject = _inject_bytes_after_open if at == BODY_START else _inject_bytes
+        return inject(body, encode_banner_html(snippet, charset))
+    # Exotic charsets such as UTF-16 cannot be scanned byte-wise.
+    html = body.decode(charset, errors="replace")
+    if at == BODY_START:
+        m = _regex(_OPEN_BODY_PATTERN.decode("ascii")).search(html)
+        if m is not None:
+            return (html[:m.end()] + snippet + html[m.end():]).encode(charset, errors="replace"), True
+    html_out = _inject_before(html, snippet, "</body>")
+    found = bool(html_out) and at != BODY_START
+    return (html_out or html + snippet).encode(charset, errors="replace"), found
+
+def _get_header(headers, name):
+    name = name.lower()
     for k, v in headers:
-        if k.lower() == name_bytes.lower(): return v
+        if k.lower() == name: return v
     return None
 
-def _set_or_replace_header(headers, name: bytes, value: bytes):
-    lname = name.lower()
-    out = [(k, v) for k, v in headers if k.lower() != lname]
-    out.append((name, value))
-    return out
+_CHARSET_PATTERN = r"charset=([A-Za-z0-9_\-]+)"
 
-def _charset_from_content_type(ct: bytes) -> str:
+@lru_cache(maxsize=256)
+def _charset_from_content_type(ct: Optional[str]) -> str:
     if not ct: return "utf-8"
-    m = re.search(br"charset=([A-Za-z0-9_\-]+)", ct)
-    return m.group(1).decode("ascii", "ignore") if m else "utf-8"
+    m = _regex(_CHARSET_PATTERN).search(ct)
+    if not m: return "utf-8"
+    charset = m.group(1)
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        return "utf-8"  # unknown label: treat as the web default
+    return charset
+
+# Lowercased header name (str for WSGI, bytes for ASGI) -> _ResponseHeaders field.
+_RESPONSE_FIELDS = {}
+for _i, _name in enumerate(("content-type", "content-length", "content-encoding", "content-range", "etag")):
+    _RESPONSE_FIELDS[_name] = _RESPONSE_FIELDS[_name.encode()] = _i
+del _i, _name
+
+class _ResponseHeaders:
+    """
+    The response headers the middleware looks at, read in a single pass.
+    Parsing stops at a non-HTML Content-Type, since such responses pass through.
+    """
+    __slots__ = ("content_type", "content_length", "encoding", "content_range", "etag", "charset")
+
+    def __init__(self, headers):
+        values = [None] * 5
+        get = _RESPONSE_FIELDS.get
+        for k, v in headers:
+            i = get(k.lower())
+            if i is None or values[i] is not None: continue
+            if isinstance(v, bytes): v = v.decode("latin-1")
+            values[i] = v
+            if i == 0 and "text/html" not in v: break
+        ct, length, encoding, self.content_range, self.etag = values
+        self.content_type = ct
+        if ct is None or "text/html" not in ct:
+            self.content_length, self.encoding, self.charset = None, "", "utf-8"
+            return
+        self.content_length = _declared_length(length)
+        self.encoding = _content_encoding(encoding)
+        self.charset = _charset_from_content_type(ct)
+
+def _derive_etag_header(headers, name, snippet: str):
+    """Replaces the ETag with the derived one and leaves everything else as is."""
+    return [(k, (_derive_etag(v.decode("latin-1"), snippet).encode("latin-1") if isinstance(v, bytes)
+                 else _derive_etag(v, snippet)) if k.lower() == name else v) for k, v in headers]
+
+def _request_headers(headers) -> Tuple[str, Optional[bytes], Optional[bytes]]:
+    """Returns (host, range, if-none-match) from ASGI request headers in one pass."""
+    host = b""
+    range_ = if_none_match = None
+    for k, v in headers:
+        if k == b"host": host = v
+        elif k == b"range": range_ = v
+        elif k == b"if-none-match": if_none_match = v
+    return host.decode("latin-1"), range_, if_none_match
+
+def _injected_headers(headers, names, snippet: str, length: Optional[int], encoded: bool):
+    """
+    Rewrites headers for an injected body in one pass: Content-Length set to
+    ``length`` (dropped when None), the ETag replaced by the derived one, and
+    Accept-Encoding added to Vary for encoded bodies. ``names`` holds the
+    (Content-Length, ETag, Vary) spellings, str for WSGI or bytes for ASGI.
+    """
+    cl_name, etag_name, vary_name = names
+    cl, etag, vary = cl_name.lower(), etag_name.lower(), vary_name.lower()
+    is_bytes = isinstance(cl_name, bytes)
+    token = b"Accept-Encoding" if is_bytes else "Accept-Encoding"
+    out = []
+    vary_seen = False
+    for k, v in headers:
+        lk = k.lower()
+        if lk == cl: continue
+        if lk == etag:
+            v = _derive_etag(v.decode("latin-1"), snippet).encode("latin-1") if is_bytes else _derive_etag(v, snippet)
+        elif encoded and lk == vary and not vary_seen:
+            vary_seen = True
+            if token.lower() not in v.lower() and v.strip() not in ("*", b"*"):
+                v = v + (b", " if is_bytes else ", ") + token
+        out.append((k, v))
+    if encoded and not vary_seen: out.append((vary_name, token))
+    if length is not None: out.append((cl_name, str(length).encode() if is_bytes else str(length)))
+    return out
+
+_WSGI_NAMES = ("Content-Length", "ETag", "Vary")
+_ASGI_NAMES = (b"content-length", b"etag", b"vary")
+
+class _StreamInjector:
+    """
+    Injects a snippet before the last ``</body`` of a byte stream, chunk by chunk.
+
+    Only a tail is held back: everything from the latest ``</body`` candidate, or
+    the last few bytes when there is none (the needle may straddle two chunks).
+    A candidate followed by more than ``window`` bytes is dropped and the snippet
+    is appended at the end instead, which keeps memory bounded.
+    """
+
+    def __init__(self, snippet: bytes, window: Optional[int] = _STREAM_WINDOW):
+        self.snippet = snippet
+        self.window = window
+        self._tail = b""
+        self._held = False
+
+    def feed(self, chunk: bytes) -> bytes:
+        """Consumes ``chunk`` and returns the bytes that are safe to send now."""
+        if not chunk: return b""
+        buf = self._tail + chunk if self._tail else bytes(chunk)
+        i = _rfind_close_body(buf)
+        if i != -1 and (self.window is None or len(buf) - i <= self.window):
+            self._tail, self._held = buf[i:], True
+            return buf[:i]
+        split = max(len(buf) - (len(_NEEDLE) - 1), 0)
+        self._tail, self._held = buf[split:], False
+        return buf[:split]
+
+    def close(self) -> bytes:
+        """Returns the held-back tail with the snippet spliced in."""
+        tail, self._tail = self._tail, b""
+        return self.snippet + tail if self._held else tail + self.snippet
+
+    def release(self) -> bytes:
+        """Returns the held-back tail untouched, for when the snippet goes elsewhere."""
+        tail, self._tail, self._held = self._tail, b"", False
+        return tail
+
+    @property
+    def found(self) -> bool:
+        return self._held
+
+    @property
+    def held(self) -> int:
+        return len(self._tail)
+
+class _BodyStartInjector:
+    """
+    Injects a snippet right after the opening ``<body ...>`` tag of a byte stream.
+
+    Until the tag shows up, what is released still goes through a _StreamInjector,
+    which holds back ``</body`` candidates, so a page without ``<body>`` gets the
+    snippet where _inject_bytes_after_open puts it. Once the snippet is out every
+    chunk passes straight through. Without a ``<body>`` tag in the first ``window``
+    bytes the _StreamInjector takes over.
+    """
+
+    def __init__(self, snippet: bytes, window: Optional[int] = _STREAM_WINDOW):
+        self.snippet = snippet
+        self.window = window
+        self._tail = b""
+        self._seen = 0
+        self._found = False
+        self._end = _StreamInjector(snippet, window)
+        self._fallback = None
+
+    def feed(self, chunk: bytes) -> bytes:
+        """Consumes ``chunk`` and returns the bytes that are safe to send now."""
+        if self._found: return bytes(chunk)
+        if self._fallback is not None: return self._fallback.feed(chunk)
+        if not chunk: return b""
+        buf = self._tail + chunk if self._tail else bytes(chunk)
+        m = _regex(_OPEN_BODY_PATTERN).search(buf)
+        if m is not None:
+            self._tail, self._found = b"", True
+            i = m.end()
+            return b"".join((self._end.release(), buf[:i], self.snippet, buf[i:]))
+        self._seen += len(chunk)
+        if self.window is not None and self._seen > self.window:
+            self._tail, self._fallback = b"", self._end
+            return self._fallback.feed(buf)
+        # Hold back a tag that may still turn out to be <body ...>.
+        i = buf.rfind(b"<")
+        if i != -1 and buf.find(b">", i) == -1:
+            self._tail = buf[i:]
+            return self._end.feed(buf[:i])
+        self._tail = b""
+        return self._end.feed(buf)
+
+    def close(self) -> bytes:
+        """Returns whatever is still held, with the snippet spliced in if it is not out yet."""
+        if self._fallback is not None: return self._fallback.close()
+        tail, self._tail = self._tail, b""
+        if self._found: return tail
+        return self._end.feed(tail) + self._end.close()
+
+    @property
+    def found(self) -> bool:
+        return self._found
+
+    @property
+    def held(self) -> int:
+        return len(self._tail) + self._end.held
+
+class _GzipDecompressor:
+    """
+    zlib-style gzip decompressor that carries on across members: RFC 1952 allows
+    several in one body, e.g. from servers that gzip each flush separately.
+    """
+
+    def __init__(self):
+        self._d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data: bytes) -> bytes:
+        parts = []
+        while data:
+            if self._d.eof: self._d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            parts.append(self._d.decompress(data))
+            data = self._d.unused_data if self._d.eof else b""
+        return b"".join(parts)
+
+    def flush(self) -> bytes:
+        return self._d.flush()
+
+class _BrotliDecompressor:
+    def __init__(self):
+        import brotli
+        self._error = brotli.error
+        self._d = brotli.Decompressor()
+
+    def decompress(self, data: bytes) -> bytes:
+        try:
+            return self._d.process(data)
+        except self._error as exc:
+            raise zlib.error(str(exc)) from exc
+
+    def flush(self) -> bytes:
+        return b""
+
+class _BrotliCompressor:
+    def __init__(self):
+        import brotli
+        self._c = brotli.Compressor()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.process(data)
+
+    def flush(self, mode: int = zlib.Z_FINISH) -> bytes:
+        return self._c.finish() if mode == zlib.Z_FINISH else self._c.flush()
+
+# Compressed input is decoded this many bytes at a time, so one step inflates to at
+# most ~1000x that (deflate's ratio limit), however small the compressed body is.
+_DECODE_SLICE = 1024
+
+def _codec(encoding: str):
+    """
+    Returns (decompressor, compressor) factories for a Content-Encoding, or None
+    when it cannot be handled. Both follow the zlib object API; decode errors
+    surface as zlib.error.
+    """
+    if encoding == "gzip":
+        return _GzipDecompressor, lambda: zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return zlib.decompressobj, lambda: zlib.compressobj(6)
+    if encoding == "br":
+        try:
+            import brotli  # noqa: F401
+        except ImportError:
+            return None
+        return _BrotliDecompressor, _BrotliCompressor
+    return None
+
+def _content_encoding(value) -> str:
+    if not value: return ""
+    if isinstance(value, bytes): value = value.decode("latin-1")
+    value = value.strip().lower()
+    return "" if value == "identity" else value
+
+class _CompressedInjector:
+    """
+    Wraps an injector with streaming decompression and recompression.
+
+    A body that does not decode sets ``failed``, and from then on chunks come back
+    untouched. Callers feed the first chunk before sending headers, so a body that
+    fails right away can still go out as it came.
+    """
+
+    def __init__(self, inner, encoding: str, sync: bool = True):
+        decompressor, compressor = _codec(encoding)
+        self.inner = inner
+        self.sync = sync
+        self.failed = False
+        self._dec = decompressor()
+        self._enc = compressor()
+
+    def feed(self, chunk: bytes) -> bytes:
+        if self.failed: return bytes(chunk)
+        out, fed = [], False
+        try:
+            # Slice by slice, so a highly compressed chunk never inflates all at once.
+            for i in range(0, len(chunk), _DECODE_SLICE):
+                data = self.inner.feed(self._dec.decompress(chunk[i:i + _DECODE_SLICE]))
+                if data:
+                    fed = True
+                    out.append(self._enc.compress(data))
+        except zlib.error:
+            self.failed = True
+            return bytes(chunk)
+        if not fed: return b""
+        # A sync flush keeps streamed pages progressive at a small cost in ratio.
+        if self.sync: out.append(self._enc.flush(zlib.Z_SYNC_FLUSH))
+        return b"".join(out)
+
+    def close(self) -> bytes:
+        if self.failed: return b""
+        try:
+            data = self.inner.feed(self._dec.flush())
+        except zlib.error:
+            self.failed = True
+            return b""
+        data += self.inner.close()
+        return self._enc.compress(data) + self._enc.flush()
+
+    @property
+    def found(self) -> bool:
+        return self.inner.found
+
+    @property
+    def held(self) -> int:
+        return self.inner.held
+
+class _TimedInjector:
+    """Records injection time, peak held bytes and needle hit/miss for an injector."""
+
+    def __init__(self, inner, metrics, hit: str = "injected.before_body"):
+        self.inner = inner
+        self.metrics = metrics
+        self.hit = hit
+        self.elapsed = 0.0
+        self.peak = 0
+
+    def feed(self, chunk: bytes) -> bytes:
+        t0 = perf_counter()
+        out = self.inner.feed(chunk)
+        self.elapsed += perf_counter() - t0
+        self.peak = max(self.peak, self.inner.held)
+        return out
+
+    def close(self) -> bytes:
+        t0 = perf_counter()
+        out = self.inner.close()
+        self.elapsed += perf_counter() - t0
+        self.metrics.observe("inject_seconds", self.elapsed)
+        self.metrics.observe("buffered_bytes", self.peak)
+        if self.failed:
+            self.metrics.inc("passthrough.decode_error")
+        else:
+            self.metrics.inc(self.hit if self.inner.found else "injected.appended")
+        return out
+
+    @property
+    def failed(self) -> bool:
+        return getattr(self.inner, "failed", False)
+
+def _hit_counter(at: str) -> str:
+    return "injected.body_start" if at == BODY_START else "injected.before_body"
+
+def _make_injector(snippet: str, charset: str, encoding: str, metrics=None, at: str = BODY_END):
+    """Returns a streaming injector for the response, or None if it must be buffered."""
+    if not _is_ascii_compatible(charset): return None
+    injector = (_BodyStartInjector if at == BODY_START else _StreamInjector)(encode_banner_html(snippet, charset))
+    if encoding: injector = _CompressedInjector(injector, encoding)
+    return _TimedInjector(injector, metrics, _hit_counter(at)) if metrics is not None else injector
+
+def _feed_first(injector, chunks) -> bytes:
+    """Feeds ``chunks`` up to the first non-empty one; a failed decode shows before headers go out."""
+    for chunk in chunks:
+        if chunk: return injector.feed(chunk)
+    return b""
+
+def _check_choice(name: str, value, choices) -> None:
+    """Rejects a misspelt string option instead of silently falling back to a default."""
+    if value not in choices:
+        raise ValueError(f"{name} must be one of {', '.join(map(repr, choices))}, not {value!r}")
+
+def _passthrough(metrics, reason: str) -> None:
+    if metrics is not None: metrics.inc("passthrough." + reason)
+    return None
+
+@lru_cache(maxsize=64)
+def _css_asset(options_key, env: str) -> Tuple[str, bytes, str]:
+    """Returns (file name, body, ETag) of the content-hashed stylesheet for ``env``."""
+    import hashlib
+    body = build_banner_css({**dict(options_key), "env": env}).encode("utf-8")
+    digest = hashlib.sha256(body).hexdigest()[:12]
+    return f"banner-{env}.{digest}.css", body, f'"{digest}"'
+
+def _css_response(options_key, css_path: str, path: str, if_none_match: Optional[str]):
+    """Returns (status, headers, body) for a request to the reserved stylesheet path."""
+    m = _regex(_CSS_NAME_PATTERN).fullmatch(path[len(css_path):])
+    if not m:
+        return "404 Not Found", [("Content-Type", "text/plain"), ("Content-Length", "9")], b"Not Found"
+    name, body, etag = _css_asset(options_key, m.group(1))
+    # A stale hash (e.g. a page cached across a deploy) still gets styled,
+    # just without the immutable caching.
+    cache_control = _CSS_CACHE_CONTROL if name == m.group(0) else "no-cache"
+    headers = [("Cache-Control", cache_control), ("ETag", etag)]
+    if if_none_match and (etag in if_none_match or if_none_match.strip() == "*"):
+        return "304 Not Modified", headers, b""
+    headers += [("Content-Type", "text/css; charset=utf-8"), ("Content-Length", str(len(body)))]
+    return "200 OK", headers, body
+
+# Injected pages carry W/"<upstream opaque>-eb<banner hash>" so caches revalidate
+# against both the upstream representation and the banner.
+_ETAG_PATTERN = r'(?:W/)?"[^"]*"|\*'
+_DERIVED_ETAG_PATTERN = r'W/"(.*)-eb([0-9a-f]{8})"'
+_NOT_MODIFIED_HEADERS = frozenset(("cache-control", "content-location", "date", "etag", "expires",
+                                   "last-modified", "vary"))
+
+@lru_cache(maxsize=512)
+def _snippet_tag(snippet: str) -> str:
+    import hashlib
+    return hashlib.sha256(snippet.encode("utf-8")).hexdigest()[:8]
+
+def _derive_etag(etag: str, snippet: str) -> str:
+    """Weak ETag for an injected page: the upstream validator plus a hash of the banner."""
+    opaque = etag.strip()
+    if opaque.startswith("W/"): opaque = opaque[2:]
+    return f'W/"{opaque.strip(chr(34))}-eb{_snippet_tag(snippet)}"'
+
+def _upstream_if_none_match(value: str, snippet: Optional[str]) -> str:
+    """Maps derived tags in If-None-Match back to the ones the wrapped app issued.
+
+    Tags derived for a different banner can never match again and are dropped.
+    """
+    tag = _snippet_tag(snippet) if snippet is not None else None
+    out = []
+    for t in _regex(_ETAG_PATTERN).findall(value):
+        m = _regex(_DERIVED_ETAG_PATTERN).fullmatch(t)
+        if m is None: out.append(t)
+        elif m.group(2) == tag: out.append(f'"{m.group(1)}"')
+    return ", ".join(out)
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison, as If-None-Match requires."""
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    return any(t == "*" or (t[2:] if t.startswith("W/") else t) == opaque
+               for t in _regex(_ETAG_PATTERN).findall(if_none_match))
+
+def _not_modified_headers(headers):
+    return [(k, v) for k, v in headers
+            if (k.decode("latin-1") if isinstance(k, bytes) else k).lower() in _NOT_MODIFIED_HEADERS]
+
+def _build_snippet(middleware, env_var, host: str, path: str, root: str = "") -> Optional[str]:
+    """
+    Classifies the request and returns the middleware's banner for it, or None for prod.
+    ``root`` is where the app is mounted (SCRIPT_NAME / root_path), which the
+    stylesheet link needs to reach the middleware.
+    """
+    metrics = middleware.metrics
+    if metrics is not None: t0 = perf_counter()
+    env = classify_env(env_var=env_var, host=host, path=path)
+    if metrics is not None: metrics.observe("classify_seconds", perf_counter() - t0)
+
+    if is_prod(env):
+        return _passthrough(metrics, "prod")
+
+    # Build banner options
+    if metrics is not None: t0 = perf_counter()
+    banner_options = {**middleware.options, "env": env, "host": host}
+    if middleware.css_path is not None:
+        banner_options["css_href"] = root.rstrip("/") + middleware.css_path + _css_asset(middleware._options_key, env)[0]
+    snippet = build_banner_html(banner_options)
+    if metrics is not None: metrics.observe("snippet_seconds", perf_counter() - t0)
+    return snippet
+
+def _record_injection(metrics, body_len: int, t0: float, found: bool, at: str = BODY_END) -> None:
+    metrics.observe("buffered_bytes", body_len)
+    metrics.observe("inject_seconds", perf_counter() - t0)
+    metrics.inc(_hit_counter(at) if found else "injected.appended")
+
+def _decompress(body: bytes, encoding: str, limit: Optional[int] = None) -> Optional[bytes]:
+    """Decompresses a complete body; None as soon as the output passes ``limit`` bytes."""
+    d = _codec(encoding)[0]()
+    if limit is None: return d.decompress(body) + d.flush()
+    parts, size = [], 0
+    for i in range(0, len(body), _DECODE_SLICE):
+        parts.append(d.decompress(body[i:i + _DECODE_SLICE]))
+        size += len(parts[-1])
+        if size > limit: return None
+    parts.append(d.flush())
+    if size + len(parts[-1]) > limit: return None
+    return b"".join(parts)
+
+def _inject_encoded(body: bytes, snippet: str, charset: str, encoding: str,
+                    at: str = BODY_END, limit: Optional[int] = None) -> Tuple[Optional[bytes], bool]:
+    """
+    Injects into a complete body, decompressing and recompressing it if needed.
+    Returns (None, False) when the decompressed body is bigger than ``limit``.
+    """
+    if not encoding:
+        return _inject_body(body, snippet, charset, at)
+    plain = _decompress(body, encoding, limit)
+    if plain is None: return None, False
+    plain_out, found = _inject_body(plain, snippet, charset, at)
+    c = _codec(encoding)[1]()
+    return c.compress(plain_out) + c.flush(), found
+
+class _ClosingIterator:
+    """Iterates ``gen`` and forwards ``close()`` to the wrapped WSGI iterable."""
+
+    def __init__(self, gen, app_iter):
+        self._gen = gen
+        self._app_iter = app_iter
+
+    def __iter__(self):
+        return self._gen
+
+    def close(self):
+        self._gen.close()
+        if hasattr(self._app_iter, "close"): self._app_iter.close()
 
 class WSGIBannerMiddleware:
-    def __init__(self, app, env_var_name: str = "APP_ENV", **options):
+    def __init__(self, app, env_var_name: str = "APP_ENV", stream: bool = False,
+                 compressed: str = "inject", metrics=None, css: str = "inline",
+                 css_path: str = CSS_PATH, max_buffer_bytes: Optional[int] = None,
+                 buffer_policy: str = "passthrough", inject_at: str = BODY_END, **options):
         """
         WSGI middleware to inject environment banner.
 
         Args:
             app: WSGI application
             env_var_name: Primary environment variable to check (default: "APP_ENV")
+            stream: Forward HTML chunks as they arrive instead of buffering the whole
+                    body (default: False). Only a small tail window is held back to
+                    find </body>, and Content-Length is dropped from injected responses.
+            compressed: What to do with gzip/deflate/br encoded HTML: 'inject'
+                        (decompress, inject, recompress; default) or 'skip' (pass through).
+            metrics: Optional BannerMetrics (or any object with inc/observe, or a
+                     callable(name, value)) receiving per-request timings and counters.
+            css: 'inline' (default) embeds the banner's <style> in every page; 'link'
+                 serves it as a content-hashed, long-cached stylesheet under css_path
+                 and injects only a <link> plus the banner markup.
+            css_path: Reserved URL prefix for the stylesheet (default: "/__envbanner/")
+            max_buffer_bytes: Most body bytes held in memory for one response (default: no limit).
+                              With a limit, compressed HTML is injected while streaming, and
+                              compressed pages in other charsets whose decoded body is over
+                              the limit pass through untouched.
+            buffer_policy: What happens to bigger responses: 'passthrough' (default) sends
+                           them untouched, 'spool' moves them to a SpooledTemporaryFile and
+                           injects from there. A Content-Length over the limit is acted on
+                           before any body is read.
+            inject_at: 'body-end' (default) puts the banner before the last </body>;
+                       'body-start' puts it right after the opening <body ...> tag, so
+                       with stream=True nothing after that tag is held back.
             **options: Additional banner options:
                 - text: Custom banner text
                 - background: Custom background color (hex)
@@ -42,59 +699,314 @@ class WSGIBannerMiddleware:
                 - show_host: Whether to show hostname (default: True)
                 - opacity: Banner opacity 0.0-1.0
         """
+        _check_choice("compressed", compressed, ("inject", "skip"))
+        _check_choice("css", css, ("inline", "link"))
+        _check_choice("buffer_policy", buffer_policy, ("passthrough", "spool"))
+        _check_choice("inject_at", inject_at, (BODY_END, BODY_START))
         self.app = app
         self.env_var_name = env_var_name
+        self.stream = stream
+        self.compressed = compressed
+        self.metrics = as_metrics(metrics)
+        self.css_path = css_path if css == "link" else None
+        self.max_buffer_bytes = max_buffer_bytes
+        self.buffer_policy = buffer_policy
+        self.inject_at = inject_at
         self.options = options
+        self._options_key = tuple(sorted(options.items()))
+        # Resolved once: a prod process never pays for buffering or classification.
+        self.env_var = os.getenv(env_var_name) or os.getenv("ENVBANNER_ENV")
+        self.prod = is_prod(classify_env(env_var=self.env_var, host=None, path=None))
+
+    def _snippet_for(self, environ, status: str, parsed: _ResponseHeaders,
+                     snippet: Optional[str] = None) -> Optional[str]:
+        """Returns the banner to inject, or None when the response passes through."""
+        m = self.metrics
+        ct = parsed.content_type
+        if not (ct and "text/html" in ct):
+            return _passthrough(m, "not_html")
+        if not status.startswith("2") or int(status[:3]) in _NO_INJECT_STATUSES:
+            return _passthrough(m, "status")
+        if parsed.content_range is not None:
+            return _passthrough(m, "status")
+        encoding = parsed.encoding
+        if encoding and (self.compressed == "skip" or _codec(encoding) is None):
+            return _passthrough(m, "encoding")
+        if self.max_buffer_bytes is not None and not self.stream and self.buffer_policy == "passthrough":
+            length = parsed.content_length
+            if length is not None and length > self.max_buffer_bytes:
+                return _passthrough(m, "too_large")
+        return snippet if snippet is not None else self._request_snippet(environ)
+
+    def _request_snippet(self, environ) -> Optional[str]:
+        host = environ.get("HTTP_HOST", "") or environ.get("SERVER_NAME", "")
+        path = environ.get("PATH_INFO", "") or "/"
+        env_var = environ.get(self.env_var_name) or environ.get("ENVBANNER_ENV") or self.env_var
+        return _build_snippet(self, env_var, host, path, environ.get("SCRIPT_NAME", ""))
 
     def __call__(self, environ, start_response):
-        # Buffer response to inject HTML
-        buffer = []
-        status_headers = {}
+        if self.prod:
+            return self.app(environ, start_response)
+        if self.css_path is not None and environ.get("PATH_INFO", "").startswith(self.css_path):
+            status, headers, body = _css_response(self._options_key, self.css_path, environ["PATH_INFO"],
+                                                  environ.get("HTTP_IF_NONE_MATCH"))
+            start_response(status, headers)
+            return [b"" if environ.get("REQUEST_METHOD") == "HEAD" else body]
+        if environ.get("REQUEST_METHOD") == "HEAD" or "HTTP_RANGE" in environ:
+            # No full body to inject into: hand over without wrapping anything.
+            _passthrough(self.metrics, "request")
+            return self.app(environ, start_response)
+
+        if_none_match = environ.get("HTTP_IF_NONE_MATCH")
+        request_snippet = None
+        if if_none_match and _regex(_DERIVED_ETAG_PATTERN).search(if_none_match):
+            # Let the app revalidate the representation it actually produced.
+            request_snippet = self._request_snippet(environ)
+            upstream = _upstream_if_none_match(if_none_match, request_snippet)
+            if upstream: environ["HTTP_IF_NONE_MATCH"] = upstream
+            else: del environ["HTTP_IF_NONE_MATCH"]
+
+        # Decide at start_response time whether the body needs to be touched at all.
+        # Anything else goes straight to the server, untouched.
+        written = []
+        state = {}
         def _start_response(status, headers, exc_info=None):
-            status_headers.update(status=status, headers=headers)
-            return buffer.append
+            parsed = _ResponseHeaders(headers)
+            snippet = self._snippet_for(environ, status, parsed, request_snippet)
+            if snippet is None:
+                if request_snippet is not None and status.startswith("304"):
+                    headers = _derive_etag_header(headers, "etag", request_snippet)
+                state["passthrough"] = True
+                return start_response(status, headers, exc_info)
+            if if_none_match and parsed.etag is not None and _etag_matches(if_none_match, _derive_etag(parsed.etag, snippet)):
+                # The client already holds this page with this banner.
+                state["not_modified"] = True
+                start_response("304 Not Modified",
+                               _not_modified_headers(_injected_headers(headers, _WSGI_NAMES, snippet, None, False)),
+                               exc_info)
+                return written.append
+            state.update(status=status, headers=headers, parsed=parsed, exc_info=exc_info, snippet=snippet)
+            return written.append
 
         app_iter = self.app(environ, _start_response)
-        body = b"".join(app_iter)
-        if hasattr(app_iter, 'close'): app_iter.close()
+        if state.get("passthrough"):
+            # Hand back the app's own iterable so wsgi.file_wrapper keeps working.
+            return app_iter
+        if state.get("not_modified"):
+            if hasattr(app_iter, "close"): app_iter.close()
+            return []
 
-        status = status_headers.get("status", "200 OK")
-        headers = status_headers.get("headers", [])
-        ct = _get_header(headers, b"Content-Type")
+        respond = self._stream if self.stream else self._buffer
+        return _ClosingIterator(respond(start_response, app_iter, state, written), app_iter)
 
-        if not (ct and b"text/html" in ct and status.startswith("2")):
-            start_response(status, headers)
-            return [body]
+    @staticmethod
+    def _pull_until_started(chunks, state):
+        # Apps may defer start_response until their first chunk is produced.
+        head = []
+        while not state:
+            try:
+                head.append(next(chunks))
+            except StopIteration:
+                break
+        return head
 
-        host = environ.get("HTTP_HOST", "") or environ.get("SERVER_NAME", "")
-        path = environ.get("PATH_INFO", "") or "/"
-        env_var = environ.get(self.env_var_name) or environ.get("ENVBANNER_ENV")
-        env = classify_env(env_var=env_var, host=host, path=path)
+    def _buffer(self, start_response, app_iter, state, written):
+        chunks = iter(app_iter)
+        head = self._pull_until_started(chunks, state)
+        if state.get("not_modified"):
+            return
+        if state.get("passthrough") or not state:
+            yield from chain(head, chunks)
+            return
+        yield from self._collect(start_response, state, chain(written, head, chunks))
 
-        if is_prod(env):
-            start_response(status, headers)
-            return [body]
+    def _collect(self, start_response, state, body):
+        """Buffers ``body`` for injection, honouring max_buffer_bytes."""
+        limit = self.max_buffer_bytes
+        if limit is None:
+            yield from self._inject_buffered(start_response, state, body)
+            return
+        parsed = state["parsed"]
+        if parsed.encoding and _is_ascii_compatible(parsed.charset):
+            # The limit counts compressed bytes; decompressing a page whole could
+            # take far more, so inject while streaming instead.
+            yield from self._inject_streamed(start_response, state, body)
+            return
+
+        length = state["parsed"].content_length
+        collected = []
+        if not (self.buffer_policy == "spool" and length is not None and length > limit):
+            size = 0
+            for chunk in body:
+                collected.append(chunk)
+                size += len(chunk)
+                if size > limit: break
+            else:
+                yield from self._inject_buffered(start_response, state, collected)
+                return
+
+        if self.buffer_policy == "spool":
+            yield from self._inject_spooled(start_response, state, chain(collected, body))
+            return
+        _passthrough(self.metrics, "too_large")
+        start_response(state["status"], state["headers"], state["exc_info"])
+        yield from collected
+        yield from body
+
+    def _inject_spooled(self, start_response, state, body):
+        status, headers, snippet = state["status"], state["headers"], state["snippet"]
+        charset, encoding = state["parsed"].charset, state["parsed"].encoding
+        if self.metrics is not None: self.metrics.inc("spooled")
 
-        # Build banner options
-        banner_options = {**self.options, "env": env, "host": host}
-        snippet = build_banner_html(banner_options)
-        charset = _charset_from_content_type(ct)
-        html = body.decode(charset, errors="replace")
-        html_out = _inject_before(html, snippet, "</body>") or (html + snippet)
-        body_out = html_out.encode(charset, errors="replace")
+        from tempfile import SpooledTemporaryFile
+        with SpooledTemporaryFile(max_size=self.max_buffer_bytes) as f:
+            for chunk in body:
+                f.write(chunk)
+            size = f.tell()
 
-        headers = _set_or_replace_header(headers, b"Content-Length", str(len(body_out)).encode())
-        start_response(status, headers)
-        return [body_out]
+            if encoding or not _is_ascii_compatible(charset) or self.inject_at == BODY_START:
+                injector = _make_injector(snippet, charset, encoding, self.metrics, self.inject_at)
+                if injector is None:
+                    # A UTF-16 style page would have to be decoded in memory.
+                    _passthrough(self.metrics, "too_large")
+                    start_response(status, headers, state["exc_info"])
+                    yield from _read_range(f, 0, size)
+                    return
+                blocks = _read_range(f, 0, size)
+                first = _feed_first(injector, blocks)
+                if encoding and injector.failed:
+                    _passthrough(self.metrics, "decode_error")
+                    start_response(status, headers, state["exc_info"])
+                    yield first
+                    yield from blocks
+                    return
+                headers = _injected_headers(headers, _WSGI_NAMES, snippet, None, bool(encoding))
+                start_response(status, headers, state["exc_info"])
+                if first: yield first
+                for block in blocks:
+                    out = injector.feed(block)
+                    if out: yield out
+                yield injector.close()
+                return
+
+            # Plain body: the insertion point is known up front, so is the length.
+            offset = _rfind_close_body_in_file(f, size)
+            snippet_bytes = encode_banner_html(snippet, charset)
+            headers = _injected_headers(headers, _WSGI_NAMES, snippet, size + len(snippet_bytes), False)
+            start_response(status, headers, state["exc_info"])
+            if offset == -1:
+                yield from _read_range(f, 0, size)
+                yield snippet_bytes
+            else:
+                yield from _read_range(f, 0, offset)
+                yield snippet_bytes
+                yield from _read_range(f, offset, size)
+
+    def _inject_buffered(self, start_response, state, chunks):
+        m = self.metrics
+        if m is not None: t0 = perf_counter()
+        body = b"".join(chunks)
+        if m is not None:
+            m.observe("buffer_seconds", perf_counter() - t0)
+            t0 = perf_counter()
+
+        status, headers, snippet = state["status"], state["headers"], state["snippet"]
+        charset, encoding = state["parsed"].charset, state["parsed"].encoding
+        try:
+            body_out, found = _inject_encoded(body, snippet, charset, encoding, self.inject_at,
+                                              self.max_buffer_bytes)
+        except zlib.error:
+            # Not encoded the way the header claims: leave the body alone.
+            _passthrough(m, "decode_error")
+            start_response(status, headers, state["exc_info"])
+            yield body
+            return
+        if body_out is None:
+            # Decompressed, it would not fit in max_buffer_bytes.
+            _passthrough(m, "too_large")
+            start_response(status, headers, state["exc_info"])
+            yield body
+            return
+        if m is not None: _record_injection(m, len(body), t0, found, self.inject_at)
+
+        headers = _injected_headers(headers, _WSGI_NAMES, snippet, len(body_out), bool(encoding))
+        start_response(status, headers, state["exc_info"])
+        yield body_out
+
+    def _stream(self, start_response, app_iter, state, written):
+        chunks = iter(app_iter)
+        head = self._pull_until_started(chunks, state)
+        if state.get("not_modified"):
+            return
+        if state.get("passthrough") or not state:
+            yield from chain(head, chunks)
+            return
+        yield from self._inject_streamed(start_response, state, chain(list(written), head, chunks))
+
+    def _inject_streamed(self, start_response, state, body):
+        status, headers, snippet = state["status"], state["headers"], state["snippet"]
+        charset, encoding = state["parsed"].charset, state["parsed"].encoding
+        injector = _make_injector(snippet, charset, encoding, self.metrics, self.inject_at)
+        if injector is None:
+            # Byte-level scanning needs an ASCII-compatible charset; inject the
+            # rare UTF-16 style page from a full buffer instead.
+            yield from self._collect(start_response, state, body)
+            return
+
+        first = _feed_first(injector, body)
+        if encoding and injector.failed:
+            # Not encoded the way the header claims: leave the body alone.
+            _passthrough(self.metrics, "decode_error")
+            start_response(status, headers, state["exc_info"])
+            yield first
+            yield from body
+            return
+        headers = _injected_headers(headers, _WSGI_NAMES, snippet, None, bool(encoding))
+        start_response(status, headers, state["exc_info"])
+        if first: yield first
+        for chunk in body:
+            out = injector.feed(chunk)
+            if out: yield out
+        yield injector.close()
+
+def _app_path(scope) -> str:
+    """Returns the request path below the app's root_path (servers may or may not include it)."""
+    path, root = scope.get("path", ""), scope.get("root_path", "")
+    return path[len(root):] if root and path.startswith(root) else path
 
 class ASGIBannerMiddleware:
-    def __init__(self, app, env_var_name: str = "APP_ENV", **options):
+    def __init__(self, app, env_var_name: str = "APP_ENV", compressed: str = "inject",
+                 metrics=None, css: str = "inline", css_path: str = CSS_PATH,
+                 max_buffer_bytes: Optional[int] = None, inject_at: str = BODY_END,
+                 offload_bytes: Optional[int] = OFFLOAD_BYTES, executor=None, **options):
         """
         ASGI middleware to inject environment banner.
 
         Args:
             app: ASGI application
             env_var_name: Primary environment variable to check (default: "APP_ENV")
+            compressed: What to do with gzip/deflate/br encoded HTML: 'inject'
+                        (decompress, inject, recompress; default) or 'skip' (pass through).
+            metrics: Optional BannerMetrics (or any object with inc/observe, or a
+                     callable(name, value)) receiving per-request timings and counters.
+            css: 'inline' (default) embeds the banner's <style> in every page; 'link'
+                 serves it as a content-hashed, long-cached stylesheet under css_path
+                 and injects only a <link> plus the banner markup.
+            css_path: Reserved URL prefix for the stylesheet (default: "/__envbanner/")
+            max_buffer_bytes: Most body bytes held in memory for one response (default: no
+                              limit). HTML in ASCII-compatible charsets is streamed anyway;
+                              bigger pages in other charsets, compressed or decoded size,
+                              are passed through untouched.
+            inject_at: 'body-end' (default) puts the banner before the last </body>;
+                       'body-start' puts it right after the opening <body ...> tag, so
+                       streamed pages flush everything after that tag at once.
+            offload_bytes: Injection work above this size runs via loop.run_in_executor so
+                           other connections keep being served (default: 4 MiB; None keeps
+                           all work on the loop). Compressed bodies count 64x their size
+                           and non-ASCII charsets 8x, as their injection costs that much more.
+            executor: Executor for that work (default: the loop's default thread pool).
+                      A ProcessPoolExecutor only gets whole bodies; streaming injectors
+                      keep state, so their chunks stay on the loop.
             **options: Additional banner options:
                 - text: Custom banner text
                 - background: Custom background color (hex)
@@ -104,62 +1016,233 @@ class ASGIBannerMiddleware:
                 - show_host: Whether to show hostname (default: True)
                 - opacity: Banner opacity 0.0-1.0
         """
+        _check_choice("compressed", compressed, ("inject", "skip"))
+        _check_choice("css", css, ("inline", "link"))
+        _check_choice("inject_at", inject_at, (BODY_END, BODY_START))
         self.app = app
         self.env_var_name = env_var_name
+        self.compressed = compressed
+        self.metrics = as_metrics(metrics)
+        self.css_path = css_path if css == "link" else None
+        self.max_buffer_bytes = max_buffer_bytes
+        self.inject_at = inject_at
+        self.offload_bytes = offload_bytes
+        self.executor = executor
+        if executor is None:
+            self._offload_chunks = True
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            self._offload_chunks = not isinstance(executor, ProcessPoolExecutor)
         self.options = options
+        self._options_key = tuple(sorted(options.items()))
+        # Resolved once: a prod process never pays for buffering or classification.
+        self.env_var = os.getenv(env_var_name) or os.getenv("ENVBANNER_ENV")
+        self.prod = is_prod(classify_env(env_var=self.env_var, host=None, path=None))
+
+    async def _offload(self, cost: int, fn, *args):
+        """Runs ``fn(*args)`` in the executor once ``cost`` reaches offload_bytes, else inline."""
+        if self.offload_bytes is None or cost < self.offload_bytes:
+            return fn(*args)
+        import asyncio
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:  # not running on asyncio (e.g. trio)
+            return fn(*args)
+        if self.metrics is not None: self.metrics.inc("offloaded")
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    def _snippet_for(self, scope, host: str, status: int, parsed: _ResponseHeaders,
+                     snippet: Optional[str] = None) -> Optional[str]:
+        """Returns the banner to inject, or None when the response passes through."""
+        m = self.metrics
+        ct = parsed.content_type
+        if not (ct and "text/html" in ct):
+            return _passthrough(m, "not_html")
+        if status // 100 != 2 or status in _NO_INJECT_STATUSES:
+            return _passthrough(m, "status")
+        if parsed.content_range is not None:
+            return _passthrough(m, "status")
+        encoding = parsed.encoding
+        if encoding and (self.compressed == "skip" or _codec(encoding) is None):
+            return _passthrough(m, "encoding")
+        return snippet if snippet is not None else self._request_snippet(scope, host)
+
+    def _request_snippet(self, scope, host: str) -> Optional[str]:
+        return _build_snippet(self, self.env_var, host, scope.get("path", "/"), scope.get("root_path", ""))
 
     async def __call__(self, scope, receive, send):
-        if scope["type"] != "http":
+        if self.prod or scope["type"] != "http":
             await self.app(scope, receive, send)
             return
+        if self.css_path is not None and _app_path(scope).startswith(self.css_path):
+            await self.serve_css(scope, send)
+            return
+        host, range_, if_none_match = _request_headers(scope.get("headers", ()))
+        if scope.get("method") == "HEAD" or range_ is not None:
+            # No full body to inject into: hand over without wrapping anything.
+            _passthrough(self.metrics, "request")
+            await self.app(scope, receive, send)
+            return
+
+        if_none_match = if_none_match.decode("latin-1") if if_none_match else None
+        request_snippet = None
+        if if_none_match and _regex(_DERIVED_ETAG_PATTERN).search(if_none_match):
+            # Let the app revalidate the representation it actually produced.
+            request_snippet = self._request_snippet(scope, host)
+            upstream = _upstream_if_none_match(if_none_match, request_snippet)
+            headers = [(k, v) for k, v in scope.get("headers", ()) if k != b"if-none-match"]
+            if upstream: headers.append((b"if-none-match", upstream.encode("latin-1")))
+            scope = {**scope, "headers": headers}
 
-        response_started = False
-        response_body = b""
+        start_msg = None
+        passthrough = False
+        not_modified = False
+        injector = None
+        snippet = ""
+        charset = "utf-8"
+        encoding = ""
+        chunks = []
+        buffered = 0
+        limit = self.max_buffer_bytes
         original_send = send
 
         async def send_wrapper(message):
-            nonlocal response_started, response_body
+            nonlocal start_msg, passthrough, not_modified, injector, snippet, charset, encoding, buffered
+            if passthrough:
+                await original_send(message)
+                return
+            if not_modified:
+                return
+
             if message["type"] == "http.response.start":
-                response_started = message
+                headers = message.get("headers", [])
+                parsed = _ResponseHeaders(headers)
+                snippet = self._snippet_for(scope, host, message.get("status", 200), parsed, request_snippet)
+                if snippet is None:
+                    if request_snippet is not None and message.get("status") == 304:
+                        message = {**message, "headers": _derive_etag_header(headers, b"etag", request_snippet)}
+                    passthrough = True
+                    await original_send(message)
+                    return
+                if if_none_match and parsed.etag is not None and _etag_matches(
+                        if_none_match, _derive_etag(parsed.etag, snippet)):
+                    # The client already holds this page with this banner.
+                    not_modified = True
+                    headers = _injected_headers(headers, _ASGI_NAMES, snippet, None, False)
+                    await original_send({"type": "http.response.start", "status": 304,
+                                         "headers": _not_modified_headers(headers)})
+                    await original_send({"type": "http.response.body", "body": b""})
+                    return
+                # Hold the start message until the first body message shows
+                # whether the whole body arrives at once.
+                start_msg = message
+                charset, encoding = parsed.charset, parsed.encoding
+                if limit is not None and not _is_ascii_compatible(charset):
+                    length = parsed.content_length
+                    if length is not None and length > limit:
+                        _passthrough(self.metrics, "too_large")
+                        passthrough = True
+                        await original_send(message)
             elif message["type"] == "http.response.body":
-                response_body += message.get("body", b"")
-                if not message.get("more_body", False):
-                    await self.finalize_response(scope, original_send, response_started, response_body)
+                body = message.get("body", b"")
+                more_body = message.get("more_body", False)
+                if injector is None and not chunks and not more_body and (limit is None or not encoding):
+                    await self.finalize_response(original_send, start_msg, body, snippet, charset, encoding)
+                    start_msg = None
+                    return
+                if injector is None and not chunks:
+                    injector = _make_injector(snippet, charset, encoding, self.metrics, self.inject_at)
+                if injector is None:
+                    chunks.append(body)
+                    buffered += len(body)
+                    if limit is not None and buffered > limit:
+                        # Too big to hold: send what we have untouched, then step aside.
+                        _passthrough(self.metrics, "too_large")
+                        passthrough = True
+                        await original_send(start_msg)
+                        await original_send({"type": "http.response.body", "body": b"".join(chunks), "more_body": more_body})
+                        start_msg = None
+                        return
+                    if not more_body:
+                        await self.finalize_response(original_send, start_msg, b"".join(chunks), snippet, charset, encoding)
+                        start_msg = None
+                    return
+                # Hold the start message until a chunk shows that the body decodes.
+                if start_msg is not None and not body and more_body: return
+                cost = _injection_cost(len(body), charset, encoding) if self._offload_chunks else 0
+                out = await self._offload(cost, injector.feed, body)
+                if start_msg is not None:
+                    if encoding and injector.failed:
+                        # Not encoded the way the header claims: leave the body alone.
+                        _passthrough(self.metrics, "decode_error")
+                        passthrough = True
+                        await original_send(start_msg)
+                        await original_send({"type": "http.response.body", "body": out, "more_body": more_body})
+                        return
+                    start_msg["headers"] = _injected_headers(start_msg.get("headers", []), _ASGI_NAMES,
+                                                             snippet, None, bool(encoding))
+                    await original_send(start_msg)
+                    start_msg = None
+                if more_body:
+                    if out:
+                        await original_send({"type": "http.response.body", "body": out, "more_body": True})
+                else:
+                    await original_send({"type": "http.response.body", "body": out + injector.close()})
+            elif message["type"] in _FILE_SEND_TYPES:
+                if start_msg is not None:
+                    # File-backed body: leave it to the server's sendfile, untouched.
+                    _passthrough(self.metrics, "file")
+                    passthrough = True
+                    await original_send(start_msg)
+                    start_msg = None
+                await original_send(message)
+            elif message["type"] == "http.response.trailers":
+                if start_msg is not None:
+                    # No body came before the trailers, so there is nothing to inject into.
+                    passthrough = True
+                    await original_send(start_msg)
+                    start_msg = None
+                await original_send(message)
             else:
-                 await original_send(message)
+                await original_send(message)
 
         await self.app(scope, receive, send_wrapper)
 
-    async def finalize_response(self, scope, send, start_msg, body):
-        if not start_msg: return
-        headers = start_msg.get("headers", [])
-        ct = _get_header(headers, b"content-type")
-        status = start_msg.get("status", 200)
+    async def serve_css(self, scope, send):
+        """Answers a request for the banner stylesheet (css="link" mode)."""
+        if_none_match = _get_header(scope.get("headers", []), b"if-none-match")
+        status, headers, body = _css_response(self._options_key, self.css_path, _app_path(scope),
+                                              if_none_match.decode("latin-1") if if_none_match else None)
+        await send({
+            "type": "http.response.start",
+            "status": int(status.split(" ", 1)[0]),
+            "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+        })
+        await send({"type": "http.response.body", "body": b"" if scope.get("method") == "HEAD" else body})
 
-        if not (ct and b"text/html" in ct and status // 100 == 2):
+    async def finalize_response(self, send, start_msg, body, snippet, charset, encoding=""):
+        """Sends a fully buffered HTML response with the banner injected."""
+        m = self.metrics
+        if m is not None: t0 = perf_counter()
+        try:
+            body_out, found = await self._offload(_injection_cost(len(body), charset, encoding), _inject_encoded,
+                                                  body, snippet, charset, encoding, self.inject_at,
+                                                  self.max_buffer_bytes)
+        except zlib.error:
+            # Not encoded the way the header claims: leave the body alone.
+            _passthrough(m, "decode_error")
             await send(start_msg)
             await send({"type": "http.response.body", "body": body})
             return
-
-        host = dict(scope.get("headers", [])).get(b"host", b"").decode()
-        path = scope.get("path", "/")
-        env_var = os.getenv(self.env_var_name) or os.getenv("ENVBANNER_ENV")
-        env = classify_env(env_var=env_var, host=host, path=path)
-
-        if is_prod(env):
+        if body_out is None:
+            # Decompressed, it would not fit in max_buffer_bytes.
+            _passthrough(m, "too_large")
             await send(start_msg)
             await send({"type": "http.response.body", "body": body})
             return
+        if m is not None: _record_injection(m, len(body), t0, found, self.inject_at)
 
-        # Build banner options
-        banner_options = {**self.options, "env": env, "host": host}
-        snippet = build_banner_html(banner_options)
-        charset = _charset_from_content_type(ct)
-        html = body.decode(charset, "replace")
-        html_out = _inject_before(html, snippet, "</body>") or (html + snippet)
-        body_out = html_out.encode(charset, "replace")
-
-        final_headers = _set_or_replace_header(headers, b"content-length", str(len(body_out)).encode())
-        start_msg["headers"] = final_headers
+        start_msg["headers"] = _injected_headers(start_msg.get("headers", []), _ASGI_NAMES,
+                                                 snippet, len(body_out), bool(encoding))
         await send(start_msg)
         await send({"type": "http.response.body", "body": body_out})
@@ -0,0 +1,107 @@
+"""
+Pre-fork warmup for gunicorn and uWSGI.
+
+Workers otherwise compile the classification rules and render, encode and hash
+the banner on their first requests, each keeping its own copy. Building all of
+it once in the master, before workers fork, and freezing it there lets every
+worker share the master's copy-on-write. Call warmup() with the middleware's
+hosts and options from your own gunicorn ``when_ready`` hook; the ready-made one
+only compiles the rules and patterns:
+
+    # gunicorn.conf.py
+    from envbanner.prefork import when_ready, post_fork
+
+Calling ``gc.disable()`` at the top of the config as well keeps the master's
+heap free of collection holes; ``post_fork`` turns the collector back on in
+each worker.
+"""
+import gc
+import os
+from typing import Iterable, Optional
+
+from . import middleware
+from .core import POSITIONS, _current_rules, _norm_env, build_banner_html, classify_env, encode_banner_html, is_prod
+
+# Patterns the middlewares compile on first use.
+_PATTERNS = (middleware._CLOSE_BODY_PATTERN, middleware._OPEN_BODY_PATTERN, middleware._CHARSET_PATTERN,
+             middleware._ETAG_PATTERN, middleware._DERIVED_ETAG_PATTERN, middleware._CSS_NAME_PATTERN)
+# Content-Type values behind nearly every HTML response.
+_CONTENT_TYPES = ("text/html", "text/html; charset=utf-8")
+
+def _candidate_envs(env_var: Optional[str]) -> set:
+    """Every env a request can be classified as, given the process's env var."""
+    if _norm_env(env_var) not in (None, "auto"):
+        return {classify_env(env_var=env_var, host=None, path=None)}
+    rules = _current_rules()
+    return {"dev", *rules.envs, *(env for _, env in rules.custom), *rules.hosts.values()}
+
+def _warm_caches(charsets) -> None:
+    """Compiles the rules and the middlewares' patterns and fills their charset caches."""
+    _current_rules()
+    for pattern in _PATTERNS: middleware._regex(pattern)
+    for ct in _CONTENT_TYPES: middleware._charset_from_content_type(ct)
+    for charset in charsets: middleware._is_ascii_compatible(charset)
+
+def warmup(env_var_name: str = "APP_ENV", hosts: Iterable[str] = (), charsets: Iterable[str] = ("utf-8",),
+           css_path: Optional[str] = None, freeze: bool = True, **options) -> int:
+    """
+    Builds the state workers would otherwise build on their first requests.
+
+    Compiles DEFAULT_RULES together with ENVBANNER_MAP and the middlewares' own
+    patterns, then renders the banner for every env the rules can yield and every
+    position (only ``position`` if given), pre-encoding it for each charset and
+    hashing it for ETags. Call it in the master before workers fork.
+
+    Args:
+        env_var_name: The middleware's env_var_name (default: "APP_ENV")
+        hosts: Hostnames to prebuild for. With show_host (the default) the host is
+               part of the banner, so each host is a snippet of its own; without
+               hosts, only host-less snippets (show_host=False, adapters) are built.
+        charsets: Response charsets to pre-encode the snippets for (default: utf-8)
+        css_path: The middleware's css_path when it runs with css='link'
+        freeze: Call gc.freeze() afterwards, so workers' collections never touch
+                (and thereby copy) anything built so far
+        **options: Banner options, as passed to the middleware
+
+    Returns:
+        Number of snippets built
+    """
+    env_var = os.getenv(env_var_name) or os.getenv("ENVBANNER_ENV")
+    charsets = tuple(charsets)
+    _warm_caches(charsets)
+
+    targets = [(host, classify_env(env_var=env_var, host=host, path="/")) for host in hosts]
+    if not targets:
+        targets = [(None, env) for env in sorted(_candidate_envs(env_var))]
+    # The middleware's options carry no position when it uses the default one.
+    variants = [options] if "position" in options else [options] + [{**options, "position": p} for p in POSITIONS]
+
+    count = 0
+    for variant in variants:
+        options_key = tuple(sorted(variant.items()))
+        for host, env in targets:
+            if is_prod(env): continue
+            banner_options = {**variant, "env": env, "host": host}
+            if css_path is not None:
+                banner_options["css_href"] = css_path + middleware._css_asset(options_key, env)[0]
+            snippet = build_banner_html(banner_options)
+            middleware._snippet_tag(snippet)
+            for charset in charsets: encode_banner_html(snippet, charset)
+            count += 1
+    if freeze: gc.freeze()
+    return count
+
+def when_ready(server) -> None:
+    """
+    gunicorn hook: compiles the rules and the middlewares' patterns in the master.
+
+    Builds no snippets and leaves the heap unfrozen: with show_host on, snippets
+    depend on the hosts served, which the hook cannot know. Call warmup() with
+    your hosts and options from your own when_ready for those.
+    """
+    _warm_caches(("utf-8",))
+    server.log.info("envbanner: compiled banner rules before fork")
+
+def post_fork(server, worker) -> None:
+    """gunicorn hook: re-enables the collector in each worker (see the module docstring)."""
+    gc.enable()
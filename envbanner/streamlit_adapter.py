@@ -1,9 +1,13 @@
 # envbanner/streamlit_adapter.py
 import os
+from functools import lru_cache
 from html import escape
 from typing import Dict, Any
 from .core import classify_env, banner_palette, banner_label, is_prod
 
+# Per-session copy of the last markup, so a rerun only compares options and emits.
+_SESSION_KEY = "_envbanner_markup"
+
 def streamlit(env_var_name: str = "APP_ENV", **options):
     """
     Renders a Streamlit-safe banner using st.markdown (HTML+CSS only).
@@ -21,6 +25,9 @@ def streamlit(env_var_name: str = "APP_ENV", **options):
 
     Note: Due to Streamlit's architecture, only 'top' and 'bottom' positions are supported.
           Diagonal and corner positions are not available for Streamlit.
+
+    The markup is built once per process and options (environment variables are
+    read then), and remembered in session_state, so reruns only re-emit it.
     """
     try:
         import streamlit as st
@@ -28,13 +35,35 @@ def streamlit(env_var_name: str = "APP_ENV", **options):
         print("Warning: Streamlit is not installed. Banner will not be shown.")
         return
 
+    key = (env_var_name, options)
+    state = getattr(st, "session_state", None)
+    cached = state.get(_SESSION_KEY) if state is not None else None
+    if cached is not None and cached[0] == key:
+        markup = cached[1]
+    else:
+        try:
+            markup = _cached_markup(env_var_name, tuple(sorted(options.items())))
+        except TypeError:  # unhashable option value
+            markup = _render_markup(env_var_name, options)
+        if state is not None:
+            state[_SESSION_KEY] = (key, markup)
+
+    if markup:
+        st.markdown(markup, unsafe_allow_html=True)
+
+@lru_cache(maxsize=64)
+def _cached_markup(env_var_name: str, options_key) -> str:
+    return _render_markup(env_var_name, dict(options_key))
+
+def _render_markup(env_var_name: str, options: Dict[str, Any]) -> str:
+    """Returns the banner markup for st.markdown, or "" for prod."""
     # Streamlit can't easily access the browser URL from the server,
     # so we rely primarily on the environment variable.
     env_var = os.getenv(env_var_name) or os.getenv("ENVBANNER_ENV")
     env = classify_env(env_var=env_var, host=None, path=None)
 
     if is_prod(env):
-        return
+        return ""
 
     # Determine text and colors: use custom options first, then fall back to defaults
     default_bg, default_fg = banner_palette(env)
@@ -57,8 +86,7 @@ def streamlit(env_var_name: str = "APP_ENV", **options):
 
     # Note: Streamlit injects its own CSS which can be complex.
     # Using `position: fixed` is more reliable than `sticky` here.
-    st.markdown(
-        f"""
+    return f"""
 <div style="
   position: fixed;
   {pos_style}
@@ -83,6 +111,4 @@ def streamlit(env_var_name: str = "APP_ENV", **options):
   /* Push down/up the main Streamlit content area */
   {padding_style}
 </style>
-""",
-        unsafe_allow_html=True,
-    )
+"""
@@ -0,0 +1,106 @@
+"""
+The env-banner-inject command: where the banner lands in each file, and which
+files a repeated run leaves alone.
+
+    python -m pytest test/
+"""
+import os
+
+import pytest
+
+from envbanner import cli
+
+SNIPPET = '<div id="env-banner-bar">STAGING – tést</div>'
+SNIPPET_BYTES = SNIPPET.encode("ascii", "xmlcharrefreplace")
+
+
+def write(path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return path
+
+
+@pytest.fixture(params=["read", "mmap"])
+def read_mode(request, monkeypatch):
+    """Runs a test with files read whole and again with every file going through mmap."""
+    if request.param == "mmap": monkeypatch.setattr(cli, "MMAP_THRESHOLD", 1)
+
+
+def test_injects_before_last_close_body(tmp_path, read_mode):
+    page = write(tmp_path / "index.html", b"<html><body><p>x</p><!-- </body> --></BODY>\n</html>")
+    assert cli.inject_file(str(page), SNIPPET_BYTES) == (str(page), "injected")
+    assert page.read_bytes() == b"<html><body><p>x</p><!-- </body> -->" + SNIPPET_BYTES + b"</BODY>\n</html>"
+
+
+def test_appends_without_close_body(tmp_path, read_mode):
+    page = write(tmp_path / "fragment.htm", b"<p>fragment</p>")
+    assert cli.inject_file(str(page), SNIPPET_BYTES)[1] == "injected"
+    assert page.read_bytes() == b"<p>fragment</p>" + SNIPPET_BYTES
+
+
+def test_skips_files_with_a_banner(tmp_path, read_mode):
+    data = b"<html><body>" + SNIPPET_BYTES + b"</body></html>"
+    page = write(tmp_path / "done.html", data)
+    assert cli.inject_file(str(page), SNIPPET_BYTES)[1] == "skipped"
+    assert page.read_bytes() == data
+
+
+@pytest.mark.parametrize("bom", [b"\xff\xfe", b"\xfe\xff"])
+def test_refuses_utf16(tmp_path, bom):
+    data = bom + "<html><body></body></html>".encode("utf-16-le" if bom == b"\xff\xfe" else "utf-16-be")
+    page = write(tmp_path / "wide.html", data)
+    path, outcome = cli.inject_file(str(page), SNIPPET_BYTES)
+    assert outcome == "error: UTF-16 files are not supported"
+    assert page.read_bytes() == data
+
+
+def test_inject_tree_counts_and_encoding(tmp_path):
+    write(tmp_path / "a.html", b"<body></body>")
+    write(tmp_path / "sub" / "b.HTM", b"<body></body>")
+    write(tmp_path / "sub" / "c.txt", b"<body></body>")
+    write(tmp_path / "wide.html", b"\xff\xfe<\x00")
+    counts = cli.inject_tree(str(tmp_path), SNIPPET, jobs=1)
+    assert counts == {"injected": 2, "skipped": 0, "unchanged": 0, "errors": 1}
+    assert (tmp_path / "a.html").read_bytes() == b"<body>" + SNIPPET_BYTES + b"</body>"
+    assert b"&#8211;" in SNIPPET_BYTES
+    assert (tmp_path / "sub" / "c.txt").read_bytes() == b"<body></body>"
+    assert not [name for name in os.listdir(tmp_path) if name.startswith(".envbanner-")]
+
+
+def test_manifest_skips_unchanged_files(tmp_path):
+    site = tmp_path / "site"
+    write(site / "a.html", b"<body></body>")
+    write(site / "b.html", b"<body></body>")
+    manifest = str(tmp_path / "cache" / "manifest.json")
+
+    assert cli.inject_tree(str(site), SNIPPET, jobs=1, manifest=manifest)["injected"] == 2
+    assert cli.inject_tree(str(site), SNIPPET, jobs=1, manifest=manifest) == \
+        {"injected": 0, "skipped": 0, "unchanged": 2, "errors": 0}
+
+    # A touched file is looked at again, and found to have its banner already.
+    st = os.stat(site / "a.html")
+    os.utime(site / "a.html", ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    assert cli.inject_tree(str(site), SNIPPET, jobs=1, manifest=manifest) == \
+        {"injected": 0, "skipped": 1, "unchanged": 1, "errors": 0}
+
+    write(site / "c.html", b"<body></body>")
+    assert cli.inject_tree(str(site), SNIPPET, jobs=1, manifest=manifest) == \
+        {"injected": 1, "skipped": 0, "unchanged": 2, "errors": 0}
+    assert cli.inject_tree(str(site), SNIPPET, jobs=1, manifest=manifest, force=True) == \
+        {"injected": 0, "skipped": 3, "unchanged": 0, "errors": 0}
+
+
+def test_manifest_for_another_banner_is_ignored(tmp_path):
+    site = tmp_path / "site"
+    write(site / "a.html", b"<body></body>")
+    manifest = str(tmp_path / "manifest.json")
+    cli.inject_tree(str(site), SNIPPET, jobs=1, manifest=manifest)
+    counts = cli.inject_tree(str(site), SNIPPET.replace("STAGING", "QA"), jobs=1, manifest=manifest)
+    assert counts["unchanged"] == 0 and counts["skipped"] == 1
+
+
+def test_no_manifest_without_path(tmp_path):
+    write(tmp_path / "a.html", b"<body></body>")
+    cli.inject_tree(str(tmp_path), SNIPPET, jobs=1)
+    assert cli.inject_tree(str(tmp_path), SNIPPET, jobs=1)["skipped"] == 1
+    assert sorted(os.listdir(tmp_path)) == ["a.html"]
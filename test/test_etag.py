@@ -0,0 +1,153 @@
+"""
+Conditional requests through the middlewares: pages with a banner carry a derived
+ETag, which is mapped back to the app's own tag on the way in.
+
+    python -m pytest test/
+"""
+import asyncio
+
+import pytest
+
+from envbanner.middleware import ASGIBannerMiddleware, WSGIBannerMiddleware
+
+HOST = "app.staging.example.com"
+PAGE = b"<html><body><p>hello</p></body></html>"
+UPSTREAM = '"v1"'
+
+
+@pytest.fixture(autouse=True)
+def no_env(monkeypatch):
+    monkeypatch.delenv("APP_ENV", raising=False)
+    monkeypatch.delenv("ENVBANNER_ENV", raising=False)
+
+
+def wsgi_app(seen, honour_conditionals=True):
+    """An app that records If-None-Match and answers 304 itself unless told not to."""
+    def app(environ, start_response):
+        seen.append(environ.get("HTTP_IF_NONE_MATCH"))
+        if honour_conditionals and environ.get("HTTP_IF_NONE_MATCH") == UPSTREAM:
+            start_response("304 Not Modified", [("ETag", UPSTREAM)])
+            return []
+        start_response("200 OK", [("Content-Type", "text/html; charset=utf-8"), ("ETag", UPSTREAM),
+                                  ("Content-Length", str(len(PAGE)))])
+
+        def body():
+            seen.append("body read")
+            yield PAGE
+        return body()
+    return app
+
+
+def wsgi_get(middleware, if_none_match=None):
+    environ = {"REQUEST_METHOD": "GET", "PATH_INFO": "/", "HTTP_HOST": HOST}
+    if if_none_match is not None: environ["HTTP_IF_NONE_MATCH"] = if_none_match
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response.update(status=status, headers=dict(headers))
+    body = b"".join(middleware(environ, start_response))
+    return response["status"], response["headers"], body
+
+
+def derived_tag(middleware):
+    status, headers, body = wsgi_get(middleware)
+    assert status == "200 OK" and b"env-banner-bar" in body
+    return headers["ETag"]
+
+
+def test_page_with_banner_gets_derived_etag():
+    tag = derived_tag(WSGIBannerMiddleware(wsgi_app([])))
+    assert tag.startswith('W/"v1-eb') and tag != UPSTREAM
+
+
+def test_derived_tag_is_mapped_back_and_app_304_gets_derived_tag():
+    seen = []
+    middleware = WSGIBannerMiddleware(wsgi_app(seen))
+    tag = derived_tag(middleware)
+    seen.clear()
+    status, headers, body = wsgi_get(middleware, tag)
+    assert seen == [UPSTREAM]
+    assert status.startswith("304") and body == b""
+    assert headers["ETag"] == tag
+
+
+def test_middleware_answers_304_when_app_ignores_conditionals():
+    seen = []
+    middleware = WSGIBannerMiddleware(wsgi_app(seen, honour_conditionals=False))
+    tag = derived_tag(middleware)
+    seen.clear()
+    status, headers, body = wsgi_get(middleware, tag)
+    assert status.startswith("304") and body == b""
+    assert headers["ETag"] == tag
+    assert "body read" not in seen
+    assert "Content-Length" not in headers
+
+
+def test_tag_from_another_banner_is_dropped():
+    seen = []
+    middleware = WSGIBannerMiddleware(wsgi_app(seen))
+    stale = 'W/"v1-eb00000000"'
+    assert derived_tag(middleware) != stale
+    seen.clear()
+    status, headers, body = wsgi_get(middleware, stale)
+    assert seen[0] is None
+    assert status == "200 OK" and b"env-banner-bar" in body
+
+
+def test_other_tags_reach_the_app_unchanged():
+    seen = []
+    middleware = WSGIBannerMiddleware(wsgi_app(seen))
+    tag = derived_tag(middleware)
+    seen.clear()
+    wsgi_get(middleware, f'"other", {tag}, W/"v1-eb00000000"')
+    assert seen[0] == f'"other", {UPSTREAM}'
+
+
+def asgi_app(seen, honour_conditionals=True):
+    async def app(scope, receive, send):
+        inm = dict(scope["headers"]).get(b"if-none-match")
+        seen.append(inm)
+        if honour_conditionals and inm == UPSTREAM.encode():
+            await send({"type": "http.response.start", "status": 304, "headers": [(b"etag", UPSTREAM.encode())]})
+            await send({"type": "http.response.body", "body": b""})
+            return
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/html; charset=utf-8"), (b"etag", UPSTREAM.encode())]})
+        seen.append("body sent")
+        await send({"type": "http.response.body", "body": PAGE})
+    return app
+
+
+def asgi_get(middleware, if_none_match=None):
+    headers = [(b"host", HOST.encode())]
+    if if_none_match is not None: headers.append((b"if-none-match", if_none_match.encode()))
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+    asyncio.run(middleware({"type": "http", "method": "GET", "path": "/", "headers": headers}, None, send))
+    start = messages[0]
+    return start["status"], dict(start["headers"]), b"".join(m.get("body", b"") for m in messages[1:])
+
+
+@pytest.mark.parametrize("honour_conditionals", [True, False])
+def test_asgi_revalidation(honour_conditionals):
+    seen = []
+    middleware = ASGIBannerMiddleware(asgi_app(seen, honour_conditionals))
+    status, headers, body = asgi_get(middleware)
+    assert status == 200 and b"env-banner-bar" in body
+    tag = headers[b"etag"].decode()
+    assert tag.startswith('W/"v1-eb')
+    seen.clear()
+    status, headers, body = asgi_get(middleware, tag)
+    assert seen[0] == UPSTREAM.encode()
+    assert status == 304 and body == b""
+    assert headers[b"etag"].decode() == tag
+
+
+def test_asgi_tag_from_another_banner_is_dropped():
+    seen = []
+    middleware = ASGIBannerMiddleware(asgi_app(seen))
+    status, headers, body = asgi_get(middleware, 'W/"v1-eb00000000"')
+    assert seen[0] is None
+    assert status == 200 and b"env-banner-bar" in body
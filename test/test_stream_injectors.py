@@ -0,0 +1,44 @@
+"""
+The streaming injectors must place the banner exactly where the buffered
+functions do, however the body is split into chunks.
+
+    python -m pytest test/
+"""
+import random
+
+from envbanner.middleware import _BodyStartInjector, _StreamInjector, _inject_bytes, _inject_bytes_after_open
+
+SNIPPET = b"<div>BANNER</div>"
+PIECES = [b"<html>", b"</html>", b"<head><title>t</title></head>", b"<body>", b'<BODY class="x">',
+          b"<body/>", b"</body>", b"</BODY >", b"<bodyx>", b"<p>text</p>", b"text", b"<", b">", b"\n"]
+
+
+def documents(seed: int, count: int):
+    rnd = random.Random(seed)
+    for _ in range(count):
+        yield b"".join(rnd.choices(PIECES, k=rnd.randint(0, 12)))
+
+
+def stream(injector, doc: bytes, rnd: random.Random) -> bytes:
+    out, i = [], 0
+    while i < len(doc):
+        step = rnd.randint(1, 8)
+        out.append(injector.feed(doc[i:i + step]))
+        i += step
+    out.append(injector.close())
+    return b"".join(out)
+
+
+def check(make_injector, inject, seed: int):
+    rnd = random.Random(seed)
+    mismatches = [doc for doc in documents(seed, 20000)
+                  if stream(make_injector(SNIPPET), doc, rnd) != inject(doc, SNIPPET)[0]]
+    assert not mismatches, f"{len(mismatches)} mismatches, e.g. {mismatches[0]!r}"
+
+
+def test_body_end_matches_buffered():
+    check(_StreamInjector, _inject_bytes, seed=1)
+
+
+def test_body_start_matches_buffered():
+    check(_BodyStartInjector, _inject_bytes_after_open, seed=2)